@@ -1,43 +1,39 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
+import concurrent.futures
 import contextlib
+import itertools
 import json
+import os
 import pathlib
 import sys
 
 from collections import Counter
-from typing import Iterator
+from typing import Dict, List, Optional, Tuple
 
 
-import safetensors
-import safetensors.torch
 import torch
 from tqdm import tqdm
 
-
-class LazyTensor:
-    def __init__(
-        self,
-        filepath: pathlib.Path,
-        input_file: safetensors.safe_open,
-        name: str,
-    ):
-        self.filepath = filepath
-        self.input_file = input_file
-        self.name = name
-
-    def get(self):
-        return self.input_file.get_tensor(self.name)
-
-
-def iter_tensors(dirpath: pathlib.Path) -> Iterator[LazyTensor]:
-    for filepath in sorted(dirpath.glob("*.safetensors")):
-        safetensors_file = safetensors.safe_open(
-            filepath.as_posix(), framework="pt", device="cpu"
-        )
-        for key in safetensors_file.keys():
-            yield LazyTensor(filepath, safetensors_file, key)
+# Like bin/safetensors, find pylib relative to this script, so that it
+# runs without pylib on PYTHONPATH.
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "pylib")
+)
+
+from lazy_safetensor import (
+    BYTES_PER_ELEMENT,
+    LazySafetensor,
+    LazySafetensorCollection,
+    LazySafetensorFile,
+    SafetensorWriter,
+    plan_shards,
+    safetensor_dtype,
+    shard_filenames,
+    write_index_file,
+)
 
 
 def get_lora_names(name):
@@ -50,82 +46,347 @@ def get_lora_names(name):
     return lora_A_name, lora_B_name
 
 
-def main(args):
-    lora_config_filepath = args.lora.joinpath("adapter_config.json")
+# The size of the temporaries used when folding, per block of rows.
+FOLD_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def folded_dtype(
+    base_tensor: LazySafetensor,
+    lora_A: Optional[LazySafetensor],
+    lora_B: Optional[LazySafetensor],
+    keep_base_dtype: bool = False,
+) -> str:
+    """The dtype of the base tensor after folding in the LoRA
+
+    By default, follows pytorch's type promotion of the base tensor
+    and the LoRA factors.  If `keep_base_dtype` is True, the folded
+    tensor has the same dtype as the base tensor.  Determined from the
+    headers alone, so that each output file can be sized before any
+    tensor is folded.
+    """
+    if lora_A is None or keep_base_dtype:
+        return base_tensor.dtype
+
+    dtype = torch.promote_types(
+        base_tensor.torch_dtype,
+        torch.promote_types(lora_A.torch_dtype, lora_B.torch_dtype),
+    )
+    return safetensor_dtype(torch.empty(0, dtype=dtype))
+
+
+def fold_lora(
+    base_tensors: List[LazySafetensor],
+    lora_pairs: List[Tuple[LazySafetensor, LazySafetensor]],
+    lora_scale_factor: float,
+    dtype: Optional[torch.dtype] = None,
+) -> List[torch.Tensor]:
+    """Fold each LoRA pair into its base tensor
+
+    Computes `base + (lora_B @ lora_A) * scale` for each tensor, and
+    returns the results as `dtype`, defaulting to pytorch's type
+    promotion of the inputs.  Several tensors, which must all
+    have the same shapes and dtypes, are folded together using
+    batched matrix multiplies.
+
+    The full `lora_B @ lora_A` product is never materialized.
+    Instead, the product is added to the output one block of rows at
+    a time, using `lora_B[rows] @ lora_A`.  The arithmetic uses
+    pytorch's type promotion of the inputs.  If this differs from
+    `dtype`, each block is computed in a temporary buffer and then
+    cast into the output, so no full-size temporary is allocated.
+    """
+    compute_dtype = torch.promote_types(
+        base_tensors[0].torch_dtype,
+        torch.promote_types(lora_pairs[0][0].torch_dtype, lora_pairs[0][1].torch_dtype),
+    )
+    if dtype is None:
+        dtype = compute_dtype
+
+    # The LoRA factors are small, and may be cast up front.
+    lora_A = torch.stack([lora_A.torch() for lora_A, _ in lora_pairs])
+    lora_B = torch.stack([lora_B.torch() for _, lora_B in lora_pairs])
+    lora_A = lora_A.to(compute_dtype)
+    lora_B = lora_B.to(compute_dtype)
+
+    base = [tensor.torch() for tensor in base_tensors]
+    num_rows, num_cols = base[0].shape
+    out = torch.empty((len(base), num_rows, num_cols), dtype=dtype)
+
+    bytes_per_row = len(base) * num_cols * compute_dtype.itemsize
+    block_rows = max(1, FOLD_BLOCK_BYTES // bytes_per_row)
+    if compute_dtype == dtype:
+        block_buffer = None
+    else:
+        block_buffer = torch.empty(
+            (len(base), min(block_rows, num_rows), num_cols), dtype=compute_dtype
+        )
+
+    for row_start in range(0, num_rows, block_rows):
+        rows = slice(row_start, min(row_start + block_rows, num_rows))
+        out_block = out[:, rows]
+        if block_buffer is None:
+            block = out_block
+        else:
+            block = block_buffer[:, : rows.stop - rows.start]
+
+        for i, base_tensor in enumerate(base):
+            block[i].copy_(base_tensor[rows])
+        block.baddbmm_(lora_B[:, rows], lora_A, alpha=lora_scale_factor)
+
+        if block_buffer is not None:
+            out_block.copy_(block)
+
+    return list(out.unbind(0))
+
+
+def batch_folds(
+    base_weights: LazySafetensorCollection,
+    adapters: List[Dict[str, Tuple[LazySafetensor, LazySafetensor]]],
+    batch_size: int,
+) -> List[List[str]]:
+    """Group the tensors to be folded into batches
+
+    Each adapter is given as a dictionary from base tensor names to
+    its LoRA pair for that tensor.  Only tensors whose base weights
+    and LoRA factors have the same shapes and dtypes (e.g. the same
+    projection in every layer), and which are folded by the same
+    adapters, may be folded together.
+    """
+    groups = collections.defaultdict(list)
+    for name in base_weights.keys():
+        if any(name in lora_pairs for lora_pairs in adapters):
+            base_tensor = base_weights[name]
+            key = (
+                base_tensor.dtype,
+                base_tensor.shape,
+                *(
+                    (
+                        tuple(
+                            (tensor.dtype, tensor.shape) for tensor in lora_pairs[name]
+                        )
+                        if name in lora_pairs
+                        else None
+                    )
+                    for lora_pairs in adapters
+                ),
+            )
+            groups[key].append(name)
+
+    return [
+        group[i : i + batch_size]
+        for group in groups.values()
+        for i in range(0, len(group), batch_size)
+    ]
+
+
+def read_lora(
+    lora_dirpath: pathlib.Path, base_weights: LazySafetensorCollection
+) -> Tuple[float, Dict[str, Tuple[LazySafetensor, LazySafetensor]]]:
+    """Read the LoRA adapter in the directory
+
+    Returns the scale factor of the adapter, and a dictionary from
+    the name of each base tensor to be modified to its
+    `(lora_A, lora_B)` pair.
+    """
+    lora_config_filepath = lora_dirpath.joinpath("adapter_config.json")
     lora_config = json.load(lora_config_filepath.open())
 
     lora_scale_factor = lora_config["lora_alpha"] / lora_config["r"]
 
-    base_weights = list(iter_tensors(args.base_weights))
-    lora_weights = list(iter_tensors(args.lora))
-
-    lora_name_counts = Counter(tensor.name for tensor in lora_weights)
+    lora_files = [
+        LazySafetensorFile(filepath)
+        for filepath in sorted(lora_dirpath.glob("*.safetensors"))
+    ]
+    lora_name_counts = Counter(name for file in lora_files for name in file.keys())
     for name, count in lora_name_counts.items():
         assert count == 1, f"Multiple files contain LoRA tensor named '{name}'"
 
-    lora_lookup = {tensor.name: tensor for tensor in lora_weights}
-    assert len(lora_lookup) == len(lora_weights)
+    lora_weights = LazySafetensorCollection(*lora_files)
 
     valid_lora_names = set(
         lora_name
-        for base_tensor in base_weights
-        for lora_name in get_lora_names(base_tensor.name)
+        for base_name in base_weights.keys()
+        for lora_name in get_lora_names(base_name)
     )
-    for lora_tensor in lora_weights:
-        assert lora_tensor.name in valid_lora_names
-
-    for base_tensor in base_weights:
-        lora_A_name, lora_B_name = get_lora_names(base_tensor.name)
-        if lora_A_name in lora_lookup:
-            assert lora_B_name in lora_lookup
-        if lora_B_name in lora_lookup:
-            assert lora_A_name in lora_lookup
-
-    assert len(list(args.output.glob("*.safetensors"))) == 0
-    args.output.mkdir(parents=True, exist_ok=True)
-
-    current_filepath = None
-    current_contents = {}
-
-    def flush_current_file():
-        nonlocal current_filepath
-        nonlocal current_contents
-
-        if current_filepath is None:
-            return
+    for lora_name in lora_weights.keys():
+        assert lora_name in valid_lora_names
+
+    lora_pairs = {}
+    for base_name in base_weights.keys():
+        lora_A_name, lora_B_name = get_lora_names(base_name)
+        if lora_A_name in lora_weights:
+            assert lora_B_name in lora_weights
+        if lora_B_name in lora_weights:
+            assert lora_A_name in lora_weights
+
+        if lora_A_name in lora_weights:
+            lora_pairs[base_name] = (
+                lora_weights[lora_A_name],
+                lora_weights[lora_B_name],
+            )
+
+    return lora_scale_factor, lora_pairs
+
+
+def plan_output_files(
+    base_weights: LazySafetensorCollection,
+    output_dtypes: Dict[str, str],
+    max_file_bytes: Optional[int],
+) -> Dict[str, List[str]]:
+    """Returns the tensor names to be written to each output file
+
+    By default, the output files mirror the files of the base
+    weights.  If `max_file_bytes` is given, the tensors are instead
+    repacked into shards of at most that size.
+    """
+    if max_file_bytes is None:
+        output_files = {}
+        for name in base_weights.keys():
+            filename = base_weights[name].safetensor_file.filepath.name
+            output_files.setdefault(filename, []).append(name)
+        return output_files
+
+    shards = plan_shards(
+        [
+            (
+                name,
+                base_weights[name].num_elements
+                * BYTES_PER_ELEMENT[output_dtypes[name]],
+            )
+            for name in base_weights.keys()
+        ],
+        max_file_bytes,
+    )
+    return dict(zip(shard_filenames(len(shards)), shards))
 
-        output_filepath = args.output.joinpath(current_filepath.name)
 
-        safetensors.torch.save_file(
-            current_contents,
-            output_filepath,
-            metadata={"format": "pt"},
+def main(args):
+    base_weights = LazySafetensorCollection(args.base_weights)
+
+    adapters = [read_lora(lora_dirpath, base_weights) for lora_dirpath in args.lora]
+    lora_scale_factors = [lora_scale_factor for lora_scale_factor, _ in adapters]
+    adapter_lora_pairs = [lora_pairs for _, lora_pairs in adapters]
+
+    for output_dirpath in args.output:
+        assert len(list(output_dirpath.glob("*.safetensors"))) == 0
+        output_dirpath.mkdir(parents=True, exist_ok=True)
+
+    adapter_output_dtypes = [
+        {
+            name: folded_dtype(
+                base_weights[name],
+                *lora_pairs.get(name, (None, None)),
+                keep_base_dtype=args.keep_base_dtype,
+            )
+            for name in base_weights.keys()
+        }
+        for lora_pairs in adapter_lora_pairs
+    ]
+
+    max_file_bytes = (
+        None
+        if args.max_file_gigabytes is None
+        else int(args.max_file_gigabytes * 1024**3)
+    )
+    adapter_output_files = [
+        plan_output_files(base_weights, output_dtypes, max_file_bytes)
+        for output_dtypes in adapter_output_dtypes
+    ]
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    def _fold_batch(batch: List[str]) -> List[Tuple[int, str, torch.Tensor]]:
+        # The base tensors are read once, and folded with each adapter
+        # in turn while they are still in the page cache.
+        base_tensors = [base_weights[name] for name in batch]
+        results = []
+        for i, lora_pairs in enumerate(adapter_lora_pairs):
+            if batch[0] in lora_pairs:
+                folded = fold_lora(
+                    base_tensors,
+                    [lora_pairs[name] for name in batch],
+                    lora_scale_factors[i],
+                    dtype=(
+                        base_tensors[0].torch_dtype if args.keep_base_dtype else None
+                    ),
+                )
+                results.extend((i, name, tensor) for name, tensor in zip(batch, folded))
+        return results
+
+    # Every output file of every adapter is sized up front, and each
+    # tensor is written as soon as it has been folded.  Folds are
+    # performed by a pool of workers, with at most `args.workers`
+    # batches in memory at a time.  Meanwhile, tensors without a LoRA
+    # are copied directly from the base weights.
+    with contextlib.ExitStack() as stack:
+        progress = stack.enter_context(
+            tqdm(total=len(base_weights) * len(adapter_lora_pairs))
+        )
+        executor = stack.enter_context(
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.workers)
         )
 
-        current_filepath = None
-        current_contents = {}
-
-    for lazy_tensor in tqdm(base_weights):
-        if current_filepath and current_filepath != lazy_tensor.filepath:
-            flush_current_file()
-
-        tensor = lazy_tensor.get()
-
-        lora_A_name, lora_B_name = get_lora_names(lazy_tensor.name)
-
-        if lora_A_name in lora_lookup or lora_B_name in lora_lookup:
-            assert lora_A_name in lora_lookup and lora_B_name in lora_lookup
-
-            lora_A = lora_lookup[lora_A_name].get()
-            lora_B = lora_lookup[lora_B_name].get()
+        # For each adapter, the output file of each tensor
+        adapter_writers: List[Dict[str, SafetensorWriter]] = []
+        for output_dirpath, output_dtypes, output_files in zip(
+            args.output, adapter_output_dtypes, adapter_output_files
+        ):
+            writers = {}
+            for filename, names in output_files.items():
+                specs = {
+                    name: (output_dtypes[name], base_weights[name].shape)
+                    for name in names
+                }
+                writer = stack.enter_context(
+                    SafetensorWriter(
+                        output_dirpath.joinpath(filename),
+                        specs,
+                        metadata={"format": "pt"},
+                    )
+                )
+                writers.update((name, writer) for name in names)
+            adapter_writers.append(writers)
+
+        def _write_folded(future):
+            for i, name, tensor in future.result():
+                adapter_writers[i][name].write(name, tensor)
+                progress.update()
+
+        batches = iter(batch_folds(base_weights, adapter_lora_pairs, args.batch_size))
+        pending = collections.deque(
+            executor.submit(_fold_batch, batch)
+            for batch in itertools.islice(batches, args.workers)
+        )
 
-            new_tensor = tensor + torch.matmul(lora_B, lora_A) * lora_scale_factor
-            tensor = new_tensor
+        for name in base_weights.keys():
+            for lora_pairs, writers in zip(adapter_lora_pairs, adapter_writers):
+                if name not in lora_pairs:
+                    writers[name].copy_from(name, base_weights[name])
+                    progress.update()
 
-        current_filepath = lazy_tensor.filepath
-        current_contents[lazy_tensor.name] = tensor
+        for batch in batches:
+            _write_folded(pending.popleft())
+            pending.append(executor.submit(_fold_batch, batch))
+        while pending:
+            _write_folded(pending.popleft())
 
-    flush_current_file()
+    for output_dirpath, output_dtypes, output_files in zip(
+        args.output, adapter_output_dtypes, adapter_output_files
+    ):
+        if len(output_files) > 1:
+            write_index_file(
+                output_dirpath.joinpath("model.safetensors.index.json"),
+                weight_map={
+                    name: filename
+                    for filename, names in output_files.items()
+                    for name in names
+                },
+                total_size=sum(
+                    base_weights[name].num_elements * BYTES_PER_ELEMENT[dtype]
+                    for name, dtype in output_dtypes.items()
+                ),
+            )
 
 
 @contextlib.contextmanager
@@ -155,17 +416,62 @@ def arg_main():
     parser.add_argument(
         "--lora",
         type=pathlib.Path,
-        help="Path to directory containing *.safetensors files for the LoRA",
+        action="append",
+        required=True,
+        help=(
+            "Path to directory containing *.safetensors files for the LoRA.  "
+            "May be repeated to fold several LoRAs, each into its own copy "
+            "of the base weights, while reading the base weights only once."
+        ),
     )
     parser.add_argument(
         "--max-file-gigabytes",
         type=float,
-        help="The maximum size of each safetensors file",
+        help=(
+            "The maximum size of each safetensors file.  "
+            "If unspecified, the output files mirror those of the base weights."
+        ),
+    )
+    parser.add_argument(
+        "--keep-base-dtype",
+        action="store_true",
+        help=(
+            "Write each folded tensor with the dtype of the base tensor, "
+            "rather than promoting to the dtype of the LoRA (e.g. float32)"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of tensors, or batches of tensors, to fold concurrently",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help=(
+            "The maximum number of same-shaped tensors "
+            "to fold with a single batched matrix multiply"
+        ),
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help=(
+            "The number of threads used by pytorch for each fold.  "
+            "If unspecified, uses pytorch's default."
+        ),
     )
     parser.add_argument(
         "--output",
         type=pathlib.Path,
-        help="Path in which new *.safetensors files should be generated",
+        action="append",
+        required=True,
+        help=(
+            "Path in which new *.safetensors files should be generated.  "
+            "Must be given once for each --lora, in the same order."
+        ),
     )
     parser.add_argument(
         "--pdb",
@@ -174,6 +480,21 @@ def arg_main():
     )
 
     args = parser.parse_args()
+    if len(args.lora) != len(args.output):
+        parser.error(
+            f"Received {len(args.lora)} --lora arguments "
+            f"but {len(args.output)} --output arguments"
+        )
+
+    output_dirpaths = [output.resolve() for output in args.output]
+    if len(set(output_dirpaths)) != len(output_dirpaths):
+        parser.error("Each --output must be a different directory")
+    input_dirpaths = [lora.resolve() for lora in args.lora]
+    if args.base_weights is not None:
+        input_dirpaths.append(args.base_weights.resolve())
+    for output in output_dirpaths:
+        if output in input_dirpaths:
+            parser.error(f"--output {output} would overwrite the input weights")
 
     with contextlib.ExitStack() as stack:
         if args.pdb:
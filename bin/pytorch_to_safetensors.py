@@ -1,16 +1,67 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
 import contextlib
 import itertools
+import os
 import pathlib
 import sys
 
 import torch
-import safetensors.torch
 
 from tqdm import tqdm
 
+# Like bin/safetensors, find pylib relative to this script, so that it
+# runs without pylib on PYTHONPATH.
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "pylib")
+)
+
+from lazy_safetensor import SafetensorWriter, safetensor_dtype
+
+
+def load_pytorch_file(pytorch_bin: pathlib.Path):
+    """Load a pytorch file, without reading the tensor data
+
+    Files saved in the zip-based format (the default since pytorch
+    1.6) are memory-mapped, so tensor data is read only as it is
+    accessed.  Files in the legacy format cannot be memory-mapped,
+    and are loaded into memory instead.
+    """
+    try:
+        return torch.load(pytorch_bin, map_location="cpu", mmap=True)
+    except RuntimeError as err:
+        if "mmap" not in str(err):
+            raise
+        return torch.load(pytorch_bin, map_location="cpu")
+
+
+def convert_file(pytorch_bin: pathlib.Path, output_filepath: pathlib.Path):
+    """Convert a pytorch file to safetensors
+
+    The output file is sized from the dtypes and shapes of the
+    tensors, and each tensor's bytes are then written directly from
+    the memory map of the input.  Memory usage therefore does not
+    depend on the size of the file.
+    """
+    tensors = load_pytorch_file(pytorch_bin)
+
+    for name, tensor in tensors.items():
+        if not isinstance(tensor, torch.Tensor):
+            raise TypeError(
+                f"Expected {pytorch_bin} to contain only tensors, "
+                f"but '{name}' is a {type(tensor)}"
+            )
+
+    specs = {
+        name: (safetensor_dtype(tensor), tensor.shape)
+        for name, tensor in tensors.items()
+    }
+    with SafetensorWriter(output_filepath, specs, metadata={"format": "pt"}) as writer:
+        for name, tensor in tensors.items():
+            writer.write(name, tensor)
+
 
 def main(args):
     input_dir = args.input_dir
@@ -27,12 +78,27 @@ def main(args):
             input_dir.glob("*.pth"),
         )
     )
-    for pytorch_bin in tqdm(pytorch_bins):
-        output_filepath = output_dir.joinpath(pytorch_bin.name).with_suffix(
-            ".safetensors"
-        )
-        tensors = torch.load(pytorch_bin, map_location="cpu")
-        safetensors.torch.save_file(tensors, output_filepath.as_posix())
+    output_filepaths = [
+        output_dir.joinpath(pytorch_bin.name).with_suffix(".safetensors")
+        for pytorch_bin in pytorch_bins
+    ]
+
+    if args.jobs == 1:
+        for pytorch_bin, output_filepath in tqdm(
+            list(zip(pytorch_bins, output_filepaths))
+        ):
+            convert_file(pytorch_bin, output_filepath)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [
+            executor.submit(convert_file, pytorch_bin, output_filepath)
+            for pytorch_bin, output_filepath in zip(pytorch_bins, output_filepaths)
+        ]
+        for future in tqdm(
+            concurrent.futures.as_completed(futures), total=len(futures)
+        ):
+            future.result()
 
 
 @contextlib.contextmanager
@@ -74,6 +140,14 @@ def arg_main():
         help="The directory in which to generate *.safetensors files",
     )
 
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="The number of files to convert in parallel, each in its own process",
+    )
+
     args = parser.parse_args()
 
     with contextlib.ExitStack() as stack:
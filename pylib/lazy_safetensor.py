@@ -1,19 +1,32 @@
 #!/usr/bin/env python3
 
 
-import ctypes
-import glob
-import json
-import io
+# Recorded first, to report the import time with --profile-startup.
+import time
+
+_IMPORT_START_TIME = time.perf_counter()
+
+# Modules that are only needed by some commands (e.g. json, hashlib,
+# sqlite3, concurrent.futures) are imported where they are used, to
+# keep the startup of the interactive session fast.
+import array
+import collections
+import collections.abc
+import contextlib
+import functools
 import itertools
+import marshal
 import math
+import mmap
 import os
 import pathlib
 import re
 import struct
-import textwrap
+import threading
 import typing
-from typing import Callable, Dict, List, Optional, Union, Iterable, Iterator
+import warnings
+import weakref
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union, Iterable, Iterator
 
 # Safetensor names are defined by their enum name in the Rust
 # implementation at
@@ -67,15 +80,455 @@ SAFETENSOR_DTYPE_TO_NUMPY = {
 }
 
 
+def _tensor_sort_key(name: str):
+    # Checking isdecimal() is considerably faster than catching the
+    # ValueError from int(), which matters for files with many
+    # tensors.
+    return tuple(int(s) if s.isdecimal() else s for s in name.split("."))
+
+
+def _safetensor_dtype_to_torch() -> Dict[str, "torch.dtype"]:
+    import torch
+
+    # Because pytorch does not provide any string to dtype
+    # conversions.  It would be really, really useful if they did.
+    return {
+        "BOOL": torch.bool,
+        "U8": torch.uint8,
+        "I8": torch.int8,
+        "F8_E5M2": torch.float8_e5m2,
+        "F8_E4M3": torch.float8_e4m3fn,
+        "I16": torch.int16,
+        "U16": torch.uint16,
+        "F16": torch.float16,
+        "BF16": torch.bfloat16,
+        "I32": torch.int32,
+        "U32": torch.uint32,
+        "F32": torch.float32,
+        "F64": torch.float64,
+        "I64": torch.int64,
+        "U64": torch.uint64,
+    }
+
+
+def _is_torch_tensor(data) -> bool:
+    # Avoid importing pytorch unless it is already in use.
+    return type(data).__module__.startswith("torch") and hasattr(data, "data_ptr")
+
+
+def safetensor_dtype(array: Union["np.ndarray", "torch.Tensor"]) -> str:
+    """Returns the safetensors dtype name of a numpy array or torch tensor"""
+    if _is_torch_tensor(array):
+        lookup = {
+            torch_dtype: name
+            for name, torch_dtype in _safetensor_dtype_to_torch().items()
+        }
+        return lookup[array.dtype]
+
+    # The float8 types are not unique, and so cannot be inverted.
+    lookup = {
+        numpy_dtype: name
+        for name, numpy_dtype in SAFETENSOR_DTYPE_TO_NUMPY.items()
+        if numpy_dtype != "float8"
+    }
+    return lookup[array.dtype.name]
+
+
+def _as_byte_view(data) -> memoryview:
+    """Returns a flat view of the bytes of an array or buffer
+
+    Numpy arrays, pytorch tensors, and objects implementing the buffer
+    protocol are supported.  Non-contiguous arrays are copied.
+    """
+    if _is_torch_tensor(data):
+        import ctypes
+
+        # Pytorch tensors do not implement the buffer protocol, and
+        # converting through numpy fails for dtypes that numpy does
+        # not support.  Instead, view the tensor's memory directly.
+        tensor = data.detach().cpu().contiguous()
+        nbytes = tensor.numel() * tensor.element_size()
+        c_buffer = (ctypes.c_char * nbytes).from_address(tensor.data_ptr())
+        # The ctypes object does not own the memory, so the tensor
+        # must be kept alive along with it.
+        c_buffer._owner = tensor
+        return memoryview(c_buffer).cast("B")
+
+    if hasattr(data, "__array_interface__"):
+        import numpy as np
+
+        data = np.ascontiguousarray(data).reshape(-1)
+
+    return memoryview(data).cast("B")
+
+
+# Compact codes for each dtype, used to store headers by column.
+# Looking up the dtype by its code also provides a single shared
+# string for each dtype, rather than one string per tensor.
+DTYPE_BY_CODE = tuple(BYTES_PER_ELEMENT)
+DTYPE_CODES = {dtype: code for code, dtype in enumerate(DTYPE_BY_CODE)}
+
+# Numpy has no bfloat16 or float8 dtypes.  These are stored using an
+# unsigned integer of the same size, and are decoded to float32 when
+# converted to numpy.
+NUMPY_STORAGE_DTYPE = {
+    **SAFETENSOR_DTYPE_TO_NUMPY,
+    "F8_E5M2": "uint8",
+    "F8_E4M3": "uint8",
+    "BF16": "uint16",
+}
+
+# Number of elements decoded at a time, when converting a dtype that
+# numpy does not support.  Bounds the size of temporary arrays.
+DECODE_CHUNK_ELEMENTS = 1 << 20
+
+
+def _requires_decode(dtype: str) -> bool:
+    return NUMPY_STORAGE_DTYPE[dtype] != SAFETENSOR_DTYPE_TO_NUMPY[dtype]
+
+
+def _check_framework(framework: str):
+    if framework not in ("numpy", "torch"):
+        raise ValueError(
+            f"Unknown framework '{framework}', expected 'numpy' or 'torch'"
+        )
+
+
+def _load_copy(tensor: "LazySafetensor", framework: str):
+    """Read a tensor into a newly allocated numpy array or torch tensor"""
+    return getattr(tensor, framework)(copy=True)
+
+
+@functools.lru_cache
+def _fp8_lookup_table(dtype: str) -> "np.ndarray":
+    """Returns the float32 value of each of the 256 FP8 bit patterns
+
+    F8_E4M3 follows the "fn" variant (as `torch.float8_e4m3fn`), which
+    has no infinities, and uses only all-ones as NaN.  F8_E5M2 follows
+    IEEE-754 conventions for infinities and NaN.
+    """
+    import numpy as np
+
+    exponent_bits, mantissa_bits = {"F8_E4M3": (4, 3), "F8_E5M2": (5, 2)}[dtype]
+    bias = 2 ** (exponent_bits - 1) - 1
+    max_exponent = 2**exponent_bits - 1
+    max_mantissa = 2**mantissa_bits - 1
+
+    codes = np.arange(256, dtype=np.int64)
+    sign = np.where(codes >> 7, -1.0, 1.0)
+    exponent = (codes >> mantissa_bits) & max_exponent
+    mantissa = codes & max_mantissa
+    fraction = mantissa / 2**mantissa_bits
+
+    values = np.where(
+        exponent == 0,
+        fraction * 2.0 ** (1 - bias),
+        (1 + fraction) * 2.0 ** (exponent - bias),
+    )
+
+    if dtype == "F8_E5M2":
+        is_special = exponent == max_exponent
+        values = np.where(is_special & (mantissa == 0), np.inf, values)
+        values = np.where(is_special & (mantissa != 0), np.nan, values)
+    else:
+        is_nan = (exponent == max_exponent) & (mantissa == max_mantissa)
+        values = np.where(is_nan, np.nan, values)
+
+    return (sign * values).astype(np.float32)
+
+
+def _decode_to_float32(dtype: str, raw: "np.ndarray", out: "np.ndarray"):
+    """Decode raw BF16 or FP8 bit patterns into a float32 array
+
+    Both `raw` and `out` must be flat, with the same number of
+    elements.  No temporary arrays are allocated.
+    """
+    import numpy as np
+
+    if dtype == "BF16":
+        # A bfloat16 is the upper half of a float32.
+        out_bits = out.view(np.uint32)
+        np.copyto(out_bits, raw, casting="safe")
+        out_bits <<= 16
+    else:
+        np.take(_fp8_lookup_table(dtype), raw, out=out)
+
+
+HASH_CHUNK_BYTES = 1 << 24
+
+
+def _new_content_hasher() -> Tuple[str, object]:
+    """Returns the name of the hash algorithm, and a new hash object
+
+    Uses xxhash if it is installed, as it is considerably faster than
+    the hashes provided by hashlib.  Otherwise, falls back to blake2b.
+    Both release the GIL while hashing large buffers, so tensors may
+    be hashed in parallel from several threads.
+    """
+    try:
+        import xxhash
+    except ImportError:
+        import hashlib
+
+        return "blake2b", hashlib.blake2b(digest_size=16)
+
+    return "xxh3_128", xxhash.xxh3_128()
+
+
+class _OpenFile:
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.mmap: Optional[mmap.mmap] = None
+        self.pin_count = 0
+
+
+class _OpenFileCache:
+    """An LRU cache of open files
+
+    Opening every file of a large collection up front could exceed the
+    limit on open file descriptors.  Instead, files are opened when
+    first read, and the least recently used files are closed once more
+    than `max_open_files` are open.
+
+    A file is pinned while it is being read, and pinned files are never
+    closed.  If every open file is pinned, the limit may temporarily
+    be exceeded.
+    """
+
+    def __init__(self, max_open_files: Optional[int] = None):
+        if max_open_files is None:
+            import resource
+
+            soft_limit, _hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+            # Each open file may use two descriptors, one for the file
+            # and one held by its memory map.  Leave the remainder
+            # available for other uses.
+            max_open_files = max(16, soft_limit // 4)
+
+        self.max_open_files = max_open_files
+        self._lock = threading.Lock()
+        self._open_files: "collections.OrderedDict[int, _OpenFile]" = (
+            collections.OrderedDict()
+        )
+
+    @contextlib.contextmanager
+    def pin(self, safetensor_file: "LazySafetensorFile") -> Iterator[_OpenFile]:
+        key = id(safetensor_file)
+
+        with self._lock:
+            open_file = self._open_files.get(key)
+            if open_file is not None:
+                self._open_files.move_to_end(key)
+                open_file.pin_count += 1
+
+        if open_file is None:
+            # Opening the file happens outside of the lock, so that
+            # slow opens (e.g. on a network filesystem) may occur in
+            # parallel.
+            fd = os.open(safetensor_file.filepath, os.O_RDONLY)
+            with self._lock:
+                open_file = self._open_files.get(key)
+                if open_file is None:
+                    open_file = _OpenFile(fd)
+                    self._open_files[key] = open_file
+                else:
+                    os.close(fd)
+                    self._open_files.move_to_end(key)
+                open_file.pin_count += 1
+                self._evict()
+
+        try:
+            yield open_file
+        finally:
+            with self._lock:
+                open_file.pin_count -= 1
+                self._evict()
+
+    def close(self, key: int):
+        with self._lock:
+            open_file = self._open_files.get(key)
+            if open_file is not None and open_file.pin_count == 0:
+                del self._open_files[key]
+                self._close(open_file)
+
+    def _evict(self):
+        if len(self._open_files) <= self.max_open_files:
+            return
+
+        for key, open_file in list(self._open_files.items()):
+            if len(self._open_files) <= self.max_open_files:
+                break
+            if open_file.pin_count == 0:
+                del self._open_files[key]
+                self._close(open_file)
+
+    @staticmethod
+    def _close(open_file: _OpenFile):
+        # The memory map is not explicitly closed, as arrays may still
+        # be viewing it.  It will be closed when the last view is
+        # released.
+        open_file.mmap = None
+        os.close(open_file.fd)
+
+
+_OPEN_FILES = _OpenFileCache()
+
+
+def set_max_open_files(max_open_files: int):
+    """Set the maximum number of safetensors files kept open at once"""
+    with _OPEN_FILES._lock:
+        _OPEN_FILES.max_open_files = max_open_files
+        _OPEN_FILES._evict()
+
+
+_compile_regex = functools.lru_cache(maxsize=256)(re.compile)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_glob(pattern: str) -> Callable[[str], Optional[re.Match]]:
+    import fnmatch
+
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+def _has_glob_magic(pattern: str) -> bool:
+    return "*" in pattern or "?" in pattern or "[" in pattern
+
+
+class _NameTreeNode:
+    __slots__ = ["path", "children", "name"]
+
+    def __init__(self, path: Tuple[str, ...]):
+        self.path = path
+        self.children: Dict[str, "_NameTreeNode"] = {}
+        self.name: Optional[str] = None
+
+    def iter_subtree(self) -> Iterator["_NameTreeNode"]:
+        """Yields all strict descendants of this node"""
+        stack = list(self.children.values())
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+
+class _NameTree:
+    """Tensor names, split into a tree on the "." separator
+
+    Used to answer glob queries without matching every tensor name.
+    Literal components of the pattern are looked up directly, either
+    as children of the current node or, if preceded by a wildcard,
+    through a lookup of all nodes with that component.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self.root = _NameTreeNode(())
+        self.nodes_by_component: Dict[str, List[_NameTreeNode]] = (
+            collections.defaultdict(list)
+        )
+
+        for name in names:
+            node = self.root
+            for component in name.split("."):
+                child = node.children.get(component)
+                if child is None:
+                    child = _NameTreeNode((*node.path, component))
+                    node.children[component] = child
+                    self.nodes_by_component[component].append(child)
+                node = child
+            node.name = name
+
+    def glob(self, pattern: str) -> List[str]:
+        # A name may match in more than one way (e.g. "a.b.c" matches
+        # "*.*" as either "a.b" + "c" or "a" + "b.c"), so collect the
+        # matches into a set.
+        matches = set()
+        self._match(self.root, pattern.split("."), matches, set())
+        return list(matches)
+
+    def _match(
+        self,
+        node: _NameTreeNode,
+        parts: List[str],
+        matches: Set[str],
+        visited: Set[Tuple[int, int]],
+    ):
+        # The same node may be reached with the same remaining pattern
+        # through different groupings of earlier wildcards.
+        key = (id(node), len(parts))
+        if key in visited:
+            return
+        visited.add(key)
+
+        if not parts:
+            if node.name is not None:
+                matches.add(node.name)
+            return
+
+        part, *remaining = parts
+
+        if not _has_glob_magic(part):
+            child = node.children.get(part)
+            if child is not None:
+                self._match(child, remaining, matches, visited)
+            return
+
+        # A wildcard may match any number of components, including
+        # the "." between them.  For each possible group of
+        # components, check the group against the wildcard, then
+        # continue matching from the end of the group.
+        is_match = _compile_glob(part)
+        depth = len(node.path)
+
+        if remaining and not _has_glob_magic(remaining[0]):
+            # The next component is literal, so only the nodes with
+            # that component need to be checked.
+            candidates = (
+                candidate
+                for candidate in self.nodes_by_component.get(remaining[0], [])
+                if len(candidate.path) > depth + 1
+                and candidate.path[:depth] == node.path
+            )
+            for candidate in candidates:
+                if is_match(".".join(candidate.path[depth:-1])):
+                    self._match(candidate, remaining[1:], matches, visited)
+        else:
+            for descendant in node.iter_subtree():
+                if is_match(".".join(descendant.path[depth:])):
+                    self._match(descendant, remaining, matches, visited)
+
+
 class _GlobMixIn:
     def glob(self, pattern: str) -> List["LazySafetensor"]:
-        regex = glob.fnmatch.translate(pattern)
-        return list(self.regex(regex))
+        components = pattern.split(".")
+        if "[" in pattern or all(map(_has_glob_magic, components)):
+            # The tree only helps when the pattern has a literal
+            # component to look up.  In addition, a character class
+            # may contain a "." (e.g. "[.]"), in which case the pattern
+            # cannot be split into components.
+            import fnmatch
+
+            return list(self.regex(fnmatch.translate(pattern)))
+
+        names = self._name_tree.glob(pattern)
+        names.sort(key=self.index_of)
+        return [self[name] for name in names]
 
     def regex(self, regex: str) -> Iterator["LazySafetensor"]:
-        for name, tensor in self.items():
-            if re.match(regex, name):
-                yield tensor
+        is_match = _compile_regex(regex).match
+        for name in self.keys():
+            if is_match(name):
+                yield self[name]
+
+    @property
+    def _name_tree(self) -> _NameTree:
+        if getattr(self, "_name_tree_cache", None) is None:
+            self._name_tree_cache = _NameTree(self.keys())
+        return self._name_tree_cache
+
+    def _invalidate_name_caches(self):
+        self._name_tree_cache = None
+        super()._invalidate_name_caches()
 
 
 class _OrderedIndexMixIn:
@@ -84,47 +537,63 @@ class _OrderedIndexMixIn:
 
         def __getitem__(self, index_or_name: Union[int, str]) -> "LazySafetensor":
             if isinstance(index_or_name, int):
-                # Relies on python 3.7+ providing a guarantee that
-                # dictionaries will be ordered.
-                values = self.values()
-                try:
-                    for _ in range(index_or_name):
-                        next(values)
-                    return next(values)
-                except StopIteration:
-                    raise IndexError("list index out of range")
-
+                return old_getitem(self, self._ordered_names[index_or_name])
             elif isinstance(index_or_name, slice):
-                return list(
-                    itertools.islice(
-                        self.values(),
-                        index_or_name.start,
-                        index_or_name.stop,
-                        index_or_name.step,
-                    )
-                )
-
+                return [
+                    old_getitem(self, name)
+                    for name in self._ordered_names[index_or_name]
+                ]
             else:
                 return old_getitem(self, index_or_name)
 
         cls.__getitem__ = __getitem__
 
+    @property
+    def _ordered_names(self) -> List[str]:
+        # Relies on python 3.7+ providing a guarantee that
+        # dictionaries will be ordered.  Only the names are cached, so
+        # that indexing constructs (and reads the headers for) just the
+        # selected tensors.
+        if getattr(self, "_ordered_names_cache", None) is None:
+            self._ordered_names_cache = list(self.keys())
+        return self._ordered_names_cache
+
+    def index_of(self, name: str) -> int:
+        """Returns the position of the named tensor
+
+        Raises a KeyError if no tensor has that name.
+        """
+        if getattr(self, "_ordered_index_cache", None) is None:
+            self._ordered_index_cache = {
+                name: index for index, name in enumerate(self.keys())
+            }
+        return self._ordered_index_cache[name]
+
+    def _invalidate_name_caches(self):
+        """Discard cached positions, after the contents have changed"""
+        self._ordered_names_cache = None
+        self._ordered_index_cache = None
+
 
 class LazySafetensorCollection(_GlobMixIn, _OrderedIndexMixIn):
     def __init__(
         self,
         *safetensor_files: Iterable[Union[str, pathlib.Path, "LazySafetensorFile"]],
+        max_workers: Optional[int] = None,
+        header_cache: Optional["HeaderCache"] = None,
     ):
         self._safetensor_files = [
             safetensor_file
             for file_or_path in safetensor_files
-            for safetensor_file in self._normalize_file(file_or_path)
+            for safetensor_file in self._normalize_file(file_or_path, header_cache)
         ]
+        self._max_workers = max_workers
 
     @classmethod
     def _normalize_file(
         cls,
         safetensor_file: Union[str, pathlib.Path, "LazySafetensorFile"],
+        header_cache: Optional["HeaderCache"] = None,
     ) -> Iterator["LazySafeTensorFile"]:
         if isinstance(safetensor_file, str):
             safetensor_file = pathlib.Path(safetensor_file)
@@ -132,17 +601,75 @@ class LazySafetensorCollection(_GlobMixIn, _OrderedIndexMixIn):
         if isinstance(safetensor_file, LazySafetensorFile):
             yield safetensor_file
         elif safetensor_file.is_dir():
-            for filepath in sorted(safetensor_file.glob("*.safetensors")):
-                yield LazySafetensorFile(filepath)
+            index_filepath = cls._find_index_file(safetensor_file)
+            if index_filepath is not None:
+                yield from cls._files_from_index(index_filepath, header_cache)
+            else:
+                for filepath in sorted(safetensor_file.glob("*.safetensors")):
+                    yield LazySafetensorFile(filepath, header_cache=header_cache)
         else:
-            yield LazySafetensorFile(safetensor_file)
+            yield LazySafetensorFile(safetensor_file, header_cache=header_cache)
+
+    @staticmethod
+    def _find_index_file(dirpath: pathlib.Path) -> Optional[pathlib.Path]:
+        """Find the index of tensor names, if present
+
+        Checkpoints that are split across several files are usually
+        accompanied by a `model.safetensors.index.json` file, whose
+        "weight_map" gives the filename containing each tensor.
+        """
+        default_filepath = dirpath.joinpath("model.safetensors.index.json")
+        if default_filepath.exists():
+            return default_filepath
+
+        index_filepaths = list(dirpath.glob("*.safetensors.index.json"))
+        if len(index_filepaths) == 1:
+            return index_filepaths[0]
+
+        return None
+
+    @staticmethod
+    def _files_from_index(
+        index_filepath: pathlib.Path,
+        header_cache: Optional["HeaderCache"] = None,
+    ) -> Iterator["LazySafetensorFile"]:
+        import json
+
+        with index_filepath.open() as f:
+            weight_map: Dict[str, str] = json.load(f)["weight_map"]
+
+        tensor_names: Dict[str, List[str]] = collections.defaultdict(list)
+        for name, filename in weight_map.items():
+            tensor_names[filename].append(name)
+
+        for filename in sorted(tensor_names):
+            yield LazySafetensorFile(
+                index_filepath.parent.joinpath(filename),
+                tensor_names=tensor_names[filename],
+                header_cache=header_cache,
+            )
 
     @property
     def _file_lookup(self):
         if not hasattr(self, "_file_lookup_cache"):
+            # Reading the headers is dominated by I/O latency, so they
+            # are read in parallel.
+            # Files whose tensor names are known from an index file
+            # are not read at all.
+            from concurrent.futures import ThreadPoolExecutor
+
+            unindexed_files = [
+                file for file in self._safetensor_files if not file._has_tensor_names
+            ]
+            if unindexed_files:
+                max_workers = self._max_workers or min(32, len(unindexed_files))
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    list(executor.map(lambda file: file.tensors, unindexed_files))
+
             self._file_lookup_cache = {
-                name: file for file in self._safetensor_files for name in file.tensors
+                name: file for file in self._safetensor_files for name in file.keys()
             }
+            self._invalidate_name_caches()
 
         return self._file_lookup_cache
 
@@ -172,91 +699,528 @@ class LazySafetensorCollection(_GlobMixIn, _OrderedIndexMixIn):
     def num_files(self) -> int:
         return len(self._safetensor_files)
 
+    def hash(self, name: str) -> str:
+        """Returns a hash of the named tensor's bytes"""
+        return self[name].content_hash()
+
+    def hashes(
+        self,
+        names: Optional[Iterable[str]] = None,
+        max_workers: Optional[int] = None,
+    ) -> Dict[str, str]:
+        """Returns the hashes of several tensors, computed in parallel
+
+        If `names` is not provided, all tensors are hashed.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        if names is None:
+            names = self.keys()
+        tensors = [self[name] for name in names]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            digests = executor.map(lambda tensor: tensor.content_hash(), tensors)
+            return {tensor.name: digest for tensor, digest in zip(tensors, digests)}
+
+    def duplicates(self, max_workers: Optional[int] = None) -> List[List[str]]:
+        """Find groups of tensors with identical contents
+
+        Tensors are duplicates if they have the same dtype, the same
+        shape, and the same bytes, such as tied input and output
+        embeddings.  Returns each group of two or more duplicate
+        tensors, in the order of their first occurrence.
+        """
+        # Only tensors with the same dtype, shape, and size could be
+        # duplicates, so unique tensors need not be hashed.
+        by_layout = collections.defaultdict(list)
+        for name, tensor in self.items():
+            by_layout[(tensor.dtype, tuple(tensor.shape))].append(name)
+        candidates = [
+            name for names in by_layout.values() if len(names) > 1 for name in names
+        ]
+
+        groups = collections.defaultdict(list)
+        for name, digest in self.hashes(candidates, max_workers).items():
+            tensor = self[name]
+            groups[(tensor.dtype, tuple(tensor.shape), digest)].append(name)
+
+        duplicates = [names for names in groups.values() if len(names) > 1]
+        duplicates.sort(key=lambda names: self.index_of(names[0]))
+        return duplicates
+
+    def stats(
+        self,
+        names: Optional[Iterable[str]] = None,
+        max_workers: Optional[int] = None,
+        chunk_elements: int = 1 << 22,
+    ) -> List["TensorStats"]:
+        """Compute summary statistics of several tensors, in parallel
+
+        If `names` is not provided, all tensors are included.  See
+        `tensor_stats` for details.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        if names is None:
+            names = self.keys()
+        tensors = [self[name] for name in names]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(
+                executor.map(
+                    lambda tensor: tensor_stats(tensor, chunk_elements), tensors
+                )
+            )
+
+    def load_partition(
+        self,
+        name: str,
+        axis: int,
+        rank: int,
+        world_size: int,
+        raw: bool = False,
+    ) -> "np.ndarray":
+        """Read one rank's partition of a tensor
+
+        The tensor is split along `axis` into `world_size` parts, and
+        only the bytes of part `rank` are read.  Partitions along the
+        first axis are returned as zero-copy views (see
+        `LazySafetensor.read_slice`).
+        """
+        key = _partition_index(self[name].shape, axis, rank, world_size)
+        return self[name].read_slice(key, raw=raw)
+
+    def load_partitions(
+        self,
+        names: Iterable[str],
+        axis: Union[int, Dict[str, int]],
+        rank: int,
+        world_size: int,
+        raw: bool = False,
+        max_workers: Optional[int] = None,
+    ) -> Dict[str, "np.ndarray"]:
+        """Read one rank's partition of several tensors
+
+        `axis` may be a single axis for all tensors, or a dictionary
+        giving the axis of each tensor.
+
+        Unlike `load_partition`, the partitions are read into newly
+        allocated arrays.  All byte ranges are planned up front, and
+        are then read in order of their position in each file, so that
+        reads are sequential.  Separate files are read in parallel.
+        """
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+
+        raw_arrays: Dict[str, "np.ndarray"] = {}
+        reads_by_file = collections.defaultdict(list)
+        for name in names:
+            tensor = self[name]
+            tensor_axis = axis[name] if isinstance(axis, dict) else axis
+            dims = _normalize_index(
+                tensor.shape,
+                _partition_index(tensor.shape, tensor_axis, rank, world_size),
+            )
+            out = np.empty(
+                [count for _, count, _, _, _ in dims],
+                dtype=NUMPY_STORAGE_DTYPE[tensor.dtype],
+            )
+            raw_arrays[name] = out
+            if out.size == 0:
+                continue
+
+            reads_by_file[tensor.safetensor_file].extend(
+                _gathered_reads(
+                    tensor.data_offset_in_file,
+                    *_plan_slice(tensor.shape, out.itemsize, dims),
+                    out,
+                )
+            )
+
+        def _read_file(item):
+            file, reads = item
+            reads.sort(key=lambda read: read[0])
+            file._readinto_many(reads)
+
+        if reads_by_file:
+            max_workers = max_workers or min(32, len(reads_by_file))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(_read_file, reads_by_file.items()))
+
+        arrays = {}
+        for name, arr in raw_arrays.items():
+            dtype = self[name].dtype
+            if _requires_decode(dtype) and not raw:
+                decoded = np.empty(arr.shape, dtype="float32")
+                _decode_to_float32(dtype, arr.reshape(-1), decoded.reshape(-1))
+                arr = decoded
+            arrays[name] = arr
+
+        return arrays
+
+    def reshard(
+        self,
+        output_dir: Union[str, pathlib.Path],
+        max_shard_bytes: int,
+        **kwargs,
+    ) -> List[pathlib.Path]:
+        """Write the tensors into shards of a given size
+
+        See the `reshard` function for details.
+        """
+        return reshard(self, output_dir, max_shard_bytes, **kwargs)
+
+    def diff(
+        self,
+        other: "LazySafetensorCollection",
+        chunk_elements: int = 1 << 22,
+    ) -> List["TensorDiff"]:
+        """Compare against another collection
+
+        See `diff_collections` for details.
+        """
+        return diff_collections(self, other, chunk_elements=chunk_elements)
+
+    def load_many(
+        self,
+        names: Iterable[str],
+        max_workers: Optional[int] = None,
+        framework: str = "numpy",
+    ) -> Dict[str, Union["np.ndarray", "torch.Tensor"]]:
+        """Read several tensors into memory in parallel
+
+        Each tensor is read into a newly allocated buffer, using a
+        pool of `max_workers` threads.  Reads are positional, so
+        tensors may be read concurrently, whether they are in the same
+        file or in different files.
+
+        `framework` may be either "numpy" or "torch", and determines
+        the type of the returned arrays.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        _check_framework(framework)
+
+        tensors = [self[name] for name in names]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            arrays = executor.map(
+                functools.partial(_load_copy, framework=framework), tensors
+            )
+            return {tensor.name: array for tensor, array in zip(tensors, arrays)}
+
+    def iter_prefetch(
+        self,
+        names: Optional[Iterable[str]] = None,
+        depth: int = 4,
+        max_bytes: int = 1 << 30,
+        framework: str = "numpy",
+        copy: bool = True,
+    ) -> Iterator[Tuple[str, Union["np.ndarray", "torch.Tensor"]]]:
+        """Iterate over tensors, loading upcoming tensors in the background
+
+        Yields `(name, array)` pairs, in order.  While the caller works
+        on one tensor, up to `depth` of the following tensors are
+        loaded ahead of time.  Loading stops early if the tensors
+        loaded ahead would exceed `max_bytes` in total, though at
+        least one tensor is always loaded ahead.  If `names` is not
+        provided, all tensors are included.
+
+        If `copy` is True, upcoming tensors are read into newly
+        allocated arrays by a pool of `depth` threads.  Otherwise, the
+        yielded arrays are views into the memory map of the file (see
+        `LazySafetensor.numpy`), and upcoming tensors are instead
+        prefetched into the page cache by the kernel (see
+        `LazySafetensor.advise_willneed`).
+
+        `framework` may be either "numpy" or "torch", and determines
+        the type of the returned arrays.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        _check_framework(framework)
+
+        if names is None:
+            names = self.keys()
+        tensors = [self[name] for name in names]
+
+        def _loaded_num_bytes(tensor: "LazySafetensor") -> int:
+            if framework == "numpy" and _requires_decode(tensor.dtype):
+                return tensor.num_elements * 4
+            return tensor.num_bytes
+
+        # As with `max_bytes`, at least one tensor is loaded ahead,
+        # even if `depth` is zero.
+        depth = max(depth, 1)
+
+        executor = ThreadPoolExecutor(max_workers=depth) if copy else None
+        # The tensors loaded ahead of the caller, along with the
+        # future of each load (if copying) and its size in bytes.
+        pending = collections.deque()
+        pending_bytes = 0
+        next_index = 0
+
+        try:
+            while pending or next_index < len(tensors):
+                while next_index < len(tensors) and len(pending) < depth:
+                    tensor = tensors[next_index]
+                    nbytes = _loaded_num_bytes(tensor)
+                    if pending and pending_bytes + nbytes > max_bytes:
+                        break
+
+                    if copy:
+                        future = executor.submit(_load_copy, tensor, framework)
+                    else:
+                        tensor.advise_willneed()
+                        future = None
+                    pending.append((tensor, future, nbytes))
+                    pending_bytes += nbytes
+                    next_index += 1
+
+                tensor, future, nbytes = pending.popleft()
+                pending_bytes -= nbytes
+                if copy:
+                    array = future.result()
+                else:
+                    array = getattr(tensor, framework)()
+                yield tensor.name, array
+
+        finally:
+            if executor is not None:
+                for _, future, _ in pending:
+                    future.cancel()
+                executor.shutdown(wait=True)
+
 
 class LazySafetensorDir(LazySafetensorCollection):
-    def __init__(self, dirpath: Union[str, pathlib.Path]):
+    def __init__(self, dirpath: Union[str, pathlib.Path], **kwargs):
         self.dirpath = pathlib.Path(dirpath)
-        super().__init__(self.dirpath)
+        self.index_filepath = self._find_index_file(self.dirpath)
+        super().__init__(self.dirpath, **kwargs)
 
 
 class LazySafetensorFile(_GlobMixIn, _OrderedIndexMixIn):
-    def __init__(self, filepath: Union[str, pathlib.Path]):
+    def __init__(
+        self,
+        filepath: Union[str, pathlib.Path],
+        tensor_names: Optional[Iterable[str]] = None,
+        header_cache: Optional["HeaderCache"] = None,
+    ):
+        """A lazily-read safetensors file
+
+        If `tensor_names` is provided (e.g. from an index file), it
+        must list the tensors contained in the file.  The names may
+        then be queried without reading the file's header.
+
+        If `header_cache` is provided, the parsed header is looked up
+        in, and saved to, the cache.
+        """
         filepath = pathlib.Path(filepath)
         self.filepath = filepath
-        self._handle = self.filepath.open("rb")
+        self._header_cache = header_cache
         self._tensors: Optional[Dict[str, "LazySafetensor"]] = None
+        self._tensor_names: Optional[Dict[str, None]] = None
+        if tensor_names is not None:
+            self._tensor_names = dict.fromkeys(
+                sorted(tensor_names, key=_tensor_sort_key)
+            )
+        self._lock = threading.Lock()
+
+        # The file is opened when first read, and is closed either
+        # when evicted from the cache of open files, or when this
+        # object is garbage-collected.
+        weakref.finalize(self, _OPEN_FILES.close, id(self))
+
+    def close(self):
+        """Close the file, if it is currently open
+
+        The file will be re-opened if any of its tensors are accessed
+        afterwards.
+        """
+        _OPEN_FILES.close(id(self))
+
+    def _readinto(self, buffer, offset: int):
+        """Fill the buffer with bytes read from the specified offset
+
+        Reads are positional, and do not use or modify the position of
+        the file handle.  This allows tensors from the same file to be
+        read concurrently from multiple threads.
+        """
+        view = memoryview(buffer).cast("B")
+        with _OPEN_FILES.pin(self) as open_file:
+            self._preadv(open_file.fd, view, offset)
+
+    def _readinto_many(self, reads: Iterable[Tuple[int, memoryview]]):
+        """Perform several positional reads
+
+        Each read is given as an offset in the file, and a byte buffer
+        to be filled from that offset.  Reads are performed in the
+        order given, and the file is opened once for all reads.
+        """
+        with _OPEN_FILES.pin(self) as open_file:
+            for offset, view in reads:
+                self._preadv(open_file.fd, view, offset)
+
+    def _preadv(self, fd: int, view: memoryview, offset: int):
+        while view:
+            nbytes_read = os.preadv(fd, [view], offset)
+            if nbytes_read == 0:
+                raise EOFError(
+                    f"Unexpected end of file while reading {self.filepath} "
+                    f"at byte {offset}"
+                )
+            view = view[nbytes_read:]
+            offset += nbytes_read
+
+    def _advise_willneed(self, offset: int, nbytes: int):
+        with _OPEN_FILES.pin(self) as open_file:
+            os.posix_fadvise(open_file.fd, offset, nbytes, os.POSIX_FADV_WILLNEED)
+
+    def _read(self, offset: int, nbytes: int) -> bytearray:
+        buffer = bytearray(nbytes)
+        self._readinto(buffer, offset)
+        return buffer
+
+    def _mapped_range(
+        self,
+        offset: int,
+        nbytes: int,
+        copy_on_write: bool = False,
+    ) -> Tuple[Union[mmap.mmap, memoryview], int]:
+        """Returns a buffer containing the requested bytes
+
+        The returned buffer is a memory map of the file, along with
+        the offset within that buffer at which the requested range
+        starts.  No data is read until the pages are accessed.
+
+        By default, a single read-only mapping of the entire file is
+        shared by all tensors.  If `copy_on_write` is True, a new
+        private mapping of the requested range is made instead.
+        Writes to a private mapping are visible only through that
+        mapping, and are never written back to the file.
+        """
+        with _OPEN_FILES.pin(self) as open_file:
+            if not copy_on_write:
+                with self._lock:
+                    if open_file.mmap is None:
+                        open_file.mmap = mmap.mmap(
+                            open_file.fd, 0, access=mmap.ACCESS_READ
+                        )
+                    return open_file.mmap, offset
+
+            # The offset of a mapping must be a multiple of the
+            # allocation granularity, so map from the preceding page
+            # boundary.
+            map_offset = offset - offset % mmap.ALLOCATIONGRANULARITY
+            private_map = mmap.mmap(
+                open_file.fd,
+                nbytes + (offset - map_offset),
+                access=mmap.ACCESS_COPY,
+                offset=map_offset,
+            )
+            return private_map, offset - map_offset
 
     @property
-    def tensors(self) -> Dict[str, "LazySafetensor"]:
+    def tensors(self) -> typing.Mapping[str, "LazySafetensor"]:
         if self._tensors is not None:
             return self._tensors
 
-        self._handle.seek(0, os.SEEK_END)
-        file_size_bytes = self._handle.tell()
-        self._handle.seek(0, os.SEEK_SET)
+        with self._lock:
+            if self._tensors is None:
+                self._tensors = self._parse_header()
+                self._invalidate_name_caches()
 
-        # A uint64 header
-        json_header_nbytes = struct.unpack("<Q", self._handle.read(8))[0]
-        # Followed by that many bytes as a JSON packet
-        json_header = self._handle.read(json_header_nbytes)
-        header = json.loads(json_header)
+        return self._tensors
 
-        def _try_int(value):
-            try:
-                return int(value)
-            except ValueError:
-                return value
-
-        def _sort_key(item):
-            name, _value = item
-            return tuple(_try_int(s) for s in name.split("."))
-
-        items = sorted(header.items(), key=_sort_key)
-
-        tensors = {}
-        for name, entry in items:
-            if name != "__metadata__":
-                dtype = entry["dtype"]
-                shape = entry["shape"]
-
-                # The data_offset is relative to the end of the JSON header,
-                # *NOT* to the file itself.
-                data_offsets = [
-                    offset + json_header_nbytes + 8 for offset in entry["data_offsets"]
-                ]
+    def _parse_header(self) -> "_TensorTable":
+        stat = self.filepath.stat()
+        # Identifies the version of the file that was parsed, for use
+        # as a key when caching.
+        self._stat = stat
 
-                assert len(data_offsets) == 2
-                assert data_offsets[0] <= data_offsets[1] <= file_size_bytes
+        columns = None
+        if self._header_cache is not None:
+            columns = self._header_cache.get(self.filepath, stat)
 
-                nbytes = data_offsets[1] - data_offsets[0]
-                expected_nbytes = math.prod(shape) * BYTES_PER_ELEMENT[dtype]
+        if columns is None:
+            columns = self._read_header_columns(stat.st_size)
+            if self._header_cache is not None:
+                self._header_cache.put(self.filepath, stat, columns)
 
-                assert nbytes == expected_nbytes
+        return _TensorTable(self, columns)
 
-                tensors[name] = LazySafetensor(
-                    self._handle,
-                    name,
-                    dtype=dtype,
-                    shape=shape,
-                    data_offset_in_file=data_offsets[0],
-                )
+    def _read_header_columns(self, file_size_bytes: int) -> "_HeaderColumns":
+        """Read the JSON header of the file
 
-        self._tensors = tensors
-        return self._tensors
+        Returns the name, dtype, shape, and data offset of each
+        tensor, sorted by name.
+        """
+        import json
+
+        # A uint64 header
+        json_header_nbytes = struct.unpack("<Q", self._read(0, 8))[0]
+        # Followed by that many bytes as a JSON packet
+        json_header = self._read(8, json_header_nbytes)
+        header = json.loads(json_header)
+
+        header.pop("__metadata__", None)
+        names = sorted(header, key=_tensor_sort_key)
+
+        dtype_codes = bytearray()
+        data_offset_column = array.array("q")
+        ndims = bytearray()
+        dims = array.array("q")
+        for name in names:
+            entry = header[name]
+            dtype = entry["dtype"]
+            shape = entry["shape"]
+
+            # The data_offset is relative to the end of the JSON header,
+            # *NOT* to the file itself.
+            data_offsets = [
+                offset + json_header_nbytes + 8 for offset in entry["data_offsets"]
+            ]
+
+            assert len(data_offsets) == 2
+            assert data_offsets[0] <= data_offsets[1] <= file_size_bytes
+
+            nbytes = data_offsets[1] - data_offsets[0]
+            expected_nbytes = math.prod(shape) * BYTES_PER_ELEMENT[dtype]
+
+            assert nbytes == expected_nbytes
+
+            dtype_codes.append(DTYPE_CODES[dtype])
+            data_offset_column.append(data_offsets[0])
+            ndims.append(len(shape))
+            dims.extend(shape)
+
+        return _HeaderColumns(
+            names=tuple(names),
+            dtype_codes=bytes(dtype_codes),
+            data_offsets=data_offset_column.tobytes(),
+            ndims=bytes(ndims),
+            dims=dims.tobytes(),
+        )
+
+    @property
+    def _has_tensor_names(self) -> bool:
+        return self._tensors is not None or self._tensor_names is not None
 
     def __len__(self) -> int:
-        return len(self.tensors)
+        return len(self.keys())
 
     def __getitem__(self, name: str) -> "LazySafetensor":
         return self.tensors[name]
 
     def __contains__(self, name: str) -> bool:
-        return name in self.tensors
+        return name in self.keys()
 
     def __iter__(self):
         return iter(self.keys())
 
     def keys(self):
+        if self._tensors is None and self._tensor_names is not None:
+            return self._tensor_names.keys()
         return self.tensors.keys()
 
     def values(self):
@@ -266,24 +1230,438 @@ class LazySafetensorFile(_GlobMixIn, _OrderedIndexMixIn):
         return self.tensors.items()
 
 
+class _HeaderColumns(typing.NamedTuple):
+    """The parsed header of a file, stored by column
+
+    Tensors are sorted by name.  The numeric columns are packed
+    native-endian arrays, which are compact in memory and fast to
+    serialize.
+    """
+
+    names: Tuple[str, ...]
+    # One byte per tensor, indexing into DTYPE_BY_CODE
+    dtype_codes: bytes
+    # One int64 per tensor
+    data_offsets: bytes
+    # One byte per tensor
+    ndims: bytes
+    # The dimensions of all tensors, concatenated, as int64
+    dims: bytes
+
+
+class _TensorTable(collections.abc.Mapping):
+    """The tensors of a file, created on demand from a columnar header
+
+    Files may contain hundreds of thousands of tensors, most of which
+    are never accessed.  Rather than creating a `LazySafetensor` for
+    each tensor when the header is parsed, each is created the first
+    time it is accessed.
+    """
+
+    def __init__(self, safetensor_file: "LazySafetensorFile", columns: _HeaderColumns):
+        self._safetensor_file = safetensor_file
+        self._names = columns.names
+        self._dtype_codes = columns.dtype_codes
+        self._data_offsets = memoryview(columns.data_offsets).cast("q")
+        self._ndims = columns.ndims
+        self._dims = memoryview(columns.dims).cast("q")
+
+        self._index = {name: i for i, name in enumerate(self._names)}
+        self._shape_starts: Optional[List[int]] = None
+        self._created: Dict[str, "LazySafetensor"] = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __contains__(self, name) -> bool:
+        return name in self._index
+
+    def __getitem__(self, name: str) -> "LazySafetensor":
+        tensor = self._created.get(name)
+        if tensor is None:
+            i = self._index[name]
+            if self._shape_starts is None:
+                self._shape_starts = [0, *itertools.accumulate(self._ndims)]
+            shape_start = self._shape_starts[i]
+            tensor = LazySafetensor(
+                self._safetensor_file,
+                name,
+                dtype=DTYPE_BY_CODE[self._dtype_codes[i]],
+                shape=tuple(self._dims[shape_start : shape_start + self._ndims[i]]),
+                data_offset_in_file=self._data_offsets[i],
+            )
+            tensor = self._created.setdefault(name, tensor)
+        return tensor
+
+
+class HeaderCache:
+    """A persistent cache of parsed safetensors headers
+
+    Parsing the header of a safetensors file requires reading and
+    parsing its JSON header, then sorting the tensor names.  For
+    checkpoints with many files, this dominates the time required to
+    open the checkpoint.  This cache stores the parsed headers in a
+    sqlite database, so that later openings of the same files may skip
+    this step.
+
+    Entries are keyed on the file's path, size, modification time, and
+    inode.  If any of these change, the cached entry is ignored and
+    replaced the next time the file is parsed.
+
+    The same database also caches the content hash of each tensor
+    (see `LazySafetensor.content_hash`), under the same key.
+
+    The cache is an optimization only.  If the database cannot be
+    opened or used, the headers are parsed from the file as usual.
+    """
+
+    # Incremented whenever the format of cached entries changes.
+    FORMAT_VERSION = 2
+
+    def __init__(self, path: Optional[Union[str, pathlib.Path]] = None):
+        if path is None:
+            cache_dir = os.environ.get("XDG_CACHE_HOME", pathlib.Path.home() / ".cache")
+            path = pathlib.Path(cache_dir).joinpath("lazy_safetensor", "headers.sqlite")
+
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._has_warned = False
+        self._format = f"{self.FORMAT_VERSION}-{marshal.version}"
+
+    @property
+    def _db(self):
+        import sqlite3
+
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            # Losing the most recent entries on a crash is acceptable
+            # for a cache, so avoid waiting on fsync.
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS headers ("
+                "  path TEXT PRIMARY KEY,"
+                "  size INTEGER,"
+                "  mtime_ns INTEGER,"
+                "  inode INTEGER,"
+                "  format TEXT,"
+                "  entries BLOB"
+                ")"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS tensor_hashes ("
+                "  path TEXT,"
+                "  size INTEGER,"
+                "  mtime_ns INTEGER,"
+                "  inode INTEGER,"
+                "  name TEXT,"
+                "  digest TEXT,"
+                "  PRIMARY KEY (path, name)"
+                ")"
+            )
+            connection.commit()
+            self._connection = connection
+
+        return self._connection
+
+    @staticmethod
+    def _key(filepath: pathlib.Path, stat: os.stat_result) -> Tuple[str, int, int, int]:
+        return (
+            str(filepath.resolve()),
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+        )
+
+    def get(
+        self, filepath: pathlib.Path, stat: os.stat_result
+    ) -> Optional[_HeaderColumns]:
+        """Returns the cached header, if present and current"""
+        import sqlite3
+
+        path, size, mtime_ns, inode = self._key(filepath, stat)
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT entries FROM headers WHERE "
+                    "path = ? AND size = ? AND mtime_ns = ? AND inode = ? "
+                    "AND format = ?",
+                    (path, size, mtime_ns, inode, self._format),
+                ).fetchone()
+            if row is None:
+                return None
+
+            # A truncated or corrupt entry is treated as a cache miss.
+            return _HeaderColumns(*marshal.loads(row[0]))
+        except (sqlite3.Error, OSError, ValueError, EOFError, TypeError) as err:
+            self._warn(err)
+            return None
+
+    def put(
+        self,
+        filepath: pathlib.Path,
+        stat: os.stat_result,
+        columns: _HeaderColumns,
+    ):
+        """Save the parsed header, replacing any previous entry"""
+        import sqlite3
+
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        *self._key(filepath, stat),
+                        self._format,
+                        # marshal supports only plain tuples
+                        marshal.dumps(tuple(columns)),
+                    ),
+                )
+                self._db.commit()
+        except (sqlite3.Error, OSError) as err:
+            self._warn(err)
+
+    def get_hash(
+        self, filepath: pathlib.Path, stat: os.stat_result, name: str
+    ) -> Optional[str]:
+        """Returns the cached content hash of a tensor, if present and current"""
+        import sqlite3
+
+        path, size, mtime_ns, inode = self._key(filepath, stat)
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT digest FROM tensor_hashes WHERE "
+                    "path = ? AND size = ? AND mtime_ns = ? AND inode = ? "
+                    "AND name = ?",
+                    (path, size, mtime_ns, inode, name),
+                ).fetchone()
+        except (sqlite3.Error, OSError) as err:
+            self._warn(err)
+            return None
+
+        return None if row is None else row[0]
+
+    def put_hash(
+        self, filepath: pathlib.Path, stat: os.stat_result, name: str, digest: str
+    ):
+        """Save the content hash of a tensor, replacing any previous entry"""
+        import sqlite3
+
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO tensor_hashes VALUES (?, ?, ?, ?, ?, ?)",
+                    (*self._key(filepath, stat), name, digest),
+                )
+                self._db.commit()
+        except (sqlite3.Error, OSError) as err:
+            self._warn(err)
+
+    def invalidate(self, filepath: Union[str, pathlib.Path]):
+        """Remove the cached entries for a file"""
+        path = str(pathlib.Path(filepath).resolve())
+        with self._lock:
+            self._db.execute("DELETE FROM headers WHERE path = ?", (path,))
+            self._db.execute("DELETE FROM tensor_hashes WHERE path = ?", (path,))
+            self._db.commit()
+
+    def clear(self):
+        """Remove all cached entries"""
+        with self._lock:
+            self._db.execute("DELETE FROM headers")
+            self._db.execute("DELETE FROM tensor_hashes")
+            self._db.commit()
+
+    def _warn(self, err: Exception):
+        if not self._has_warned:
+            self._has_warned = True
+            warnings.warn(f"Could not use safetensors header cache {self.path}: {err}")
+
+
+def _normalize_index(shape: List[int], key) -> List[Tuple[int, int, int, bool, bool]]:
+    """Convert a numpy-style index into a selection along each axis
+
+    Returns `(start, count, step, keep_dim, flip)` for each axis, with
+    a positive step.  Negative steps are converted to the equivalent
+    positive step, with `flip` set to reverse the axis afterwards.
+    `keep_dim` is False for axes indexed by an integer.
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    num_ellipsis = sum(1 for item in key if item is Ellipsis)
+    if num_ellipsis > 1:
+        raise IndexError("an index can only have a single ellipsis ('...')")
+    if len(key) - num_ellipsis > len(shape):
+        raise IndexError(
+            f"too many indices for tensor: tensor is {len(shape)}-dimensional, "
+            f"but {len(key) - num_ellipsis} were indexed"
+        )
+    if num_ellipsis:
+        i = key.index(Ellipsis)
+        key = key[:i] + (slice(None),) * (len(shape) - len(key) + 1) + key[i + 1 :]
+    key = key + (slice(None),) * (len(shape) - len(key))
+
+    dims = []
+    for axis, (extent, item) in enumerate(zip(shape, key)):
+        if isinstance(item, slice):
+            selected = range(*item.indices(extent))
+            if len(selected) == 0:
+                dims.append((0, 0, 1, True, False))
+            elif selected.step < 0:
+                dims.append((selected[-1], len(selected), -selected.step, True, True))
+            else:
+                dims.append((selected.start, len(selected), selected.step, True, False))
+        elif hasattr(item, "__index__"):
+            index = item.__index__()
+            if not -extent <= index < extent:
+                raise IndexError(
+                    f"index {index} is out of bounds for axis {axis} with size {extent}"
+                )
+            dims.append((index % extent, 1, 1, False, False))
+        else:
+            raise IndexError(
+                f"Unsupported index {item!r}.  "
+                "Only integers, slices, and Ellipsis are supported"
+            )
+
+    return dims
+
+
+def _plan_slice(
+    shape: List[int],
+    itemsize: int,
+    dims: List[Tuple[int, int, int, bool, bool]],
+) -> Tuple[int, int, List[Tuple[int, int]]]:
+    """Find the contiguous runs of bytes that hold a selection of a tensor
+
+    Given a row-major tensor, and a non-empty selection as returned by
+    `_normalize_index`, returns `(run_start, run_size, outer_axes)`.
+    The selection is made up of runs of `run_size` bytes, one for each
+    combination of indices along `outer_axes`, given as `(count,
+    byte_step)` for each axis.  The first run starts `run_start` bytes
+    from the start of the tensor.  Only the layout is computed here,
+    so that the number of runs can be inspected before choosing how
+    to read them.  See `_run_offsets` for the offset of each run.
+    """
+    strides = [itemsize * math.prod(shape[axis + 1 :]) for axis in range(len(shape))]
+
+    # Trailing axes that are selected in full form a single
+    # contiguous run, as does a unit-step range along the axis that
+    # precedes them.
+    inner = len(shape)
+    while inner > 0 and dims[inner - 1][:2] == (0, shape[inner - 1]):
+        inner -= 1
+
+    run_start = 0
+    run_size = itemsize * math.prod(shape[inner:])
+    if inner > 0 and (dims[inner - 1][2] == 1 or dims[inner - 1][1] == 1):
+        inner -= 1
+        start, count, _, _, _ = dims[inner]
+        run_start = start * strides[inner]
+        run_size *= count
+
+    # Axes with a single selected index only move the starting point.
+    outer_axes = []
+    for axis in range(inner):
+        start, count, step, _, _ = dims[axis]
+        run_start += start * strides[axis]
+        if count > 1:
+            outer_axes.append((count, step * strides[axis]))
+
+    return run_start, run_size, outer_axes
+
+
+def _run_offsets(
+    run_start: int, outer_axes: List[Tuple[int, int]], begin: int, end: int
+) -> "np.ndarray":
+    """The byte offsets of runs `begin` to `end` of a planned slice"""
+    import numpy as np
+
+    offsets = np.full(end - begin, run_start, dtype=np.int64)
+    if outer_axes:
+        indices = np.unravel_index(
+            np.arange(begin, end, dtype=np.int64), [count for count, _ in outer_axes]
+        )
+        for index, (_, byte_step) in zip(indices, outer_axes):
+            offsets += index * byte_step
+    return offsets
+
+
+# The number of run offsets computed at once while reading a slice,
+# to bound the memory used for slices with many small runs.
+RUN_BATCH_SIZE = 1 << 16
+
+
+def _gathered_reads(
+    data_offset_in_file: int,
+    run_start: int,
+    run_size: int,
+    outer_axes: List[Tuple[int, int]],
+    out: "np.ndarray",
+) -> Iterator[Tuple[int, memoryview]]:
+    """Pair each run of bytes with its position in the output array"""
+    import numpy as np
+
+    view = memoryview(out.reshape(-1).view(np.uint8))
+    num_runs = math.prod(count for count, _ in outer_axes)
+    position = 0
+    for begin in range(0, num_runs, RUN_BATCH_SIZE):
+        end = min(begin + RUN_BATCH_SIZE, num_runs)
+        for offset in _run_offsets(run_start, outer_axes, begin, end).tolist():
+            yield data_offset_in_file + offset, view[position : position + run_size]
+            position += run_size
+
+
+def _partition_index(
+    shape: List[int], axis: int, rank: int, world_size: int
+) -> Tuple[slice, ...]:
+    """The index selecting one rank's partition of a tensor
+
+    The axis is split into `world_size` contiguous parts, following
+    `numpy.array_split`: if the axis does not divide evenly, the
+    first ranks receive one extra element each.
+    """
+    if not 0 <= rank < world_size:
+        raise ValueError(f"Rank {rank} is out of range for world size {world_size}")
+    if not -len(shape) <= axis < len(shape):
+        raise IndexError(f"axis {axis} is out of bounds for {len(shape)}-d tensor")
+    axis = axis % len(shape)
+
+    base, remainder = divmod(shape[axis], world_size)
+    start = rank * base + min(rank, remainder)
+    stop = start + base + (1 if rank < remainder else 0)
+
+    return (slice(None),) * axis + (slice(start, stop),)
+
+
 class LazySafetensor:
+    # A checkpoint may contain a very large number of tensors, so
+    # avoid a per-instance __dict__.
+    __slots__ = ("safetensor_file", "name", "dtype", "shape", "data_offset_in_file")
+
     def __init__(
         self,
-        file_handle: typing.IO[bytes],
+        safetensor_file: "LazySafetensorFile",
         name: str,
         dtype: str,
-        shape: List[int],
+        shape: Tuple[int, ...],
         data_offset_in_file: int,
     ):
-        self.file_handle = file_handle
+        self.safetensor_file = safetensor_file
         self.name = name
         self.dtype = dtype
-        self.shape = shape
+        self.shape = tuple(shape)
         self.data_offset_in_file = data_offset_in_file
 
     def __repr__(self):
         dtype = SAFETENSOR_DTYPE_TO_NUMPY[self.dtype]
-        return f"LazySafetensor('{dtype}', {self.shape}, '{self.name}')"
+        return f"LazySafetensor('{dtype}', {list(self.shape)}, '{self.name}')"
 
     @property
     def bytes_per_element(self) -> int:
@@ -297,72 +1675,1129 @@ class LazySafetensor:
     def num_elements(self) -> int:
         return int(math.prod(self.shape))
 
-    def numpy(self) -> "np.ndarray":
+    @property
+    def torch_dtype(self) -> "torch.dtype":
+        return _safetensor_dtype_to_torch()[self.dtype]
+
+    def readinto(self, buffer, offset: int = 0):
+        """Read the tensor's bytes into a buffer
+
+        Fills the buffer with the tensor's bytes, starting `offset`
+        bytes from the start of the tensor.  The read is positional,
+        and is safe to perform concurrently with other reads from the
+        same file.
+        """
+        nbytes = memoryview(buffer).nbytes
+        if offset < 0 or offset + nbytes > self.num_bytes:
+            raise ValueError(
+                f"Cannot read bytes [{offset}, {offset + nbytes}) "
+                f"from tensor '{self.name}' of {self.num_bytes} bytes"
+            )
+        self.safetensor_file._readinto(buffer, self.data_offset_in_file + offset)
+
+    def advise_willneed(self):
+        """Hint that the tensor's bytes will be read soon
+
+        The kernel begins reading the tensor into the page cache in
+        the background, and this method returns immediately.  Later
+        accesses through a memory map or a read may then be served
+        from memory.  Does nothing on platforms without
+        `os.posix_fadvise`.
+        """
+        if self.num_bytes > 0 and hasattr(os, "posix_fadvise"):
+            self.safetensor_file._advise_willneed(
+                self.data_offset_in_file, self.num_bytes
+            )
+
+    def _buffer(
+        self, copy_on_write: bool, copy: bool
+    ) -> Tuple[Union[mmap.mmap, memoryview, bytearray], int]:
+        if copy:
+            buffer = bytearray(self.num_bytes)
+            self.readinto(buffer)
+            return buffer, 0
+
+        return self.safetensor_file._mapped_range(
+            self.data_offset_in_file,
+            self.num_bytes,
+            copy_on_write=copy_on_write,
+        )
+
+    def numpy(
+        self,
+        copy_on_write: bool = False,
+        copy: bool = False,
+        raw: bool = False,
+    ) -> "np.ndarray":
+        """Returns a view of the tensor
+
+        The returned array is backed by a memory map of the
+        safetensors file, and no data is read until it is accessed.
+
+        By default, the array is read-only.  If `copy_on_write` is
+        True, the array is writable.  Any writes are private to the
+        returned array, and are not written back to the file.
+
+        If `copy` is True, the tensor is instead read into a newly
+        allocated array before returning.
+
+        Numpy does not support the BF16 and FP8 dtypes.  Tensors of
+        these dtypes are decoded into a newly allocated float32 array,
+        in chunks of `DECODE_CHUNK_ELEMENTS` elements.  If `raw` is
+        True, the undecoded bit patterns are returned instead, as an
+        unsigned integer array, subject to `copy_on_write` and `copy`
+        as above.
+        """
         import numpy as np
 
-        dtype = SAFETENSOR_DTYPE_TO_NUMPY[self.dtype]
-        self.file_handle.seek(self.data_offset_in_file)
-        arr = np.fromfile(self.file_handle, dtype=dtype, count=self.num_elements)
+        if _requires_decode(self.dtype) and not raw:
+            out = np.empty(self.shape, dtype="float32")
+            flat_out = out.reshape(-1)
+            for start, chunk in self.iter_chunks(DECODE_CHUNK_ELEMENTS, raw=True):
+                _decode_to_float32(
+                    self.dtype, chunk, flat_out[start : start + chunk.size]
+                )
+            return out
+
+        dtype = NUMPY_STORAGE_DTYPE[self.dtype]
+        if self.num_elements == 0:
+            return np.empty(self.shape, dtype=dtype)
+
+        buffer, offset = self._buffer(copy_on_write, copy)
+        arr = np.frombuffer(
+            buffer,
+            dtype=dtype,
+            count=self.num_elements,
+            offset=offset,
+        )
         arr = arr.reshape(self.shape)
 
         return arr
 
-    def torch(self) -> "torch.array":
-        import torch
+    def iter_chunks(
+        self, chunk_elements: int, raw: bool = False
+    ) -> Iterator[Tuple[int, "np.ndarray"]]:
+        """Iterate over the flattened tensor, in chunks
 
-        # Because pytorch does not provide any string to dtype
-        # conversions.  It would be really, really useful if they did.
-        dtype = {
-            "BOOL": torch.bool,
-            "U8": torch.uint8,
-            "I8": torch.int8,
-            "F8_E5M2": torch.float8_e5m2,
-            "F8_E4M3": torch.float8_e4m3fn,
-            "I16": torch.int16,
-            "U16": torch.uint16,
-            "F16": torch.float16,
-            "BF16": torch.bfloat16,
-            "I32": torch.int32,
-            "U32": torch.uint32,
-            "F32": torch.float32,
-            "F64": torch.float64,
-            "I64": torch.int64,
-            "U64": torch.uint64,
-        }[self.dtype]
-
-        # Pytorch cannot load a tensor from a file handle
-        # (`torch.from_file` requires a path to a file).  Need to read
-        # the bytes, then make a `BytesIO` object, and then return a
-        # readable/writable view into the `BytesIO`.
-        #
-        # If pytorch does add support for a file handle in
-        # `torch.from_file`, must ensure that `shared=False` is
-        # provided.  Otherwise, pytorch will attempt to write any
-        # changes back to the original file.
-        self.file_handle.seek(self.data_offset_in_file)
-        tensor_bytes = io.BytesIO(self.file_handle.read(self.num_bytes))
-        rw_buffer = tensor_bytes.getbuffer()
-
-        arr = torch.frombuffer(
-            rw_buffer,
-            dtype=dtype,
-            count=self.num_elements,
+        Yields `(start, chunk)` pairs, where `chunk` is a flat array of
+        up to `chunk_elements` elements, starting at element `start`.
+        Chunks are read-only views into the memory map of the file.
+
+        BF16 and FP8 chunks are decoded to newly allocated float32
+        arrays, unless `raw` is True.  Only one chunk needs to be
+        decoded at a time, so large tensors may be upcast without a
+        full-size temporary.
+        """
+        import numpy as np
+
+        if self.num_elements == 0:
+            return
+
+        storage_dtype = NUMPY_STORAGE_DTYPE[self.dtype]
+        buffer, offset = self._buffer(copy_on_write=False, copy=False)
+        flat = np.frombuffer(
+            buffer, dtype=storage_dtype, count=self.num_elements, offset=offset
         )
+        decode = _requires_decode(self.dtype) and not raw
+
+        for start in range(0, self.num_elements, chunk_elements):
+            chunk = flat[start : start + chunk_elements]
+            if decode:
+                decoded = np.empty(chunk.size, dtype="float32")
+                _decode_to_float32(self.dtype, chunk, decoded)
+                chunk = decoded
+            yield start, chunk
+
+    def content_hash(self) -> str:
+        """Returns a hash of the tensor's bytes
+
+        The hash is computed over the memory map of the file, in
+        chunks of `HASH_CHUNK_BYTES`.  If the file has a header cache,
+        the hash is cached alongside the header.
+
+        The hash covers only the tensor's bytes.  Tensors with
+        different dtypes or shapes may have the same hash.
+        """
+        file = self.safetensor_file
+        cache = file._header_cache
+
+        if cache is not None:
+            digest = cache.get_hash(file.filepath, file._stat, self.name)
+            if digest is not None:
+                return digest
+
+        algorithm, hasher = _new_content_hasher()
+        if self.num_bytes > 0:
+            buffer, offset = self._buffer(copy_on_write=False, copy=False)
+            with memoryview(buffer) as view:
+                end = offset + self.num_bytes
+                for start in range(offset, end, HASH_CHUNK_BYTES):
+                    hasher.update(view[start : min(start + HASH_CHUNK_BYTES, end)])
+
+        digest = f"{algorithm}:{hasher.hexdigest()}"
+
+        if cache is not None:
+            cache.put_hash(file.filepath, file._stat, self.name, digest)
+
+        return digest
+
+    def __getitem__(self, key) -> "np.ndarray":
+        """Read part of the tensor
+
+        Accepts integers, slices, and Ellipsis, with the same meaning
+        as for a numpy array.  Only the bytes within the selection are
+        read, so a single row of a large tensor may be inspected
+        without reading the remainder.  See `read_slice` for details.
+        """
+        return self.read_slice(key)
+
+    def read_slice(self, key, raw: bool = False) -> "np.ndarray":
+        """Read part of the tensor
+
+        If the selected elements are contiguous in the file (e.g. a
+        range of rows), the returned array is a read-only view into
+        the memory map of the file, and no data is read until it is
+        accessed.  Otherwise, the selected elements are copied into a
+        new array.  Runs of contiguous elements that are at least a
+        page in size are read with positional reads, skipping the
+        remainder of the tensor.  Smaller runs are copied from the
+        memory map, as every page would be read regardless.
+
+        As with `numpy()`, BF16 and FP8 tensors are decoded to
+        float32, unless `raw` is True.
+        """
+        import numpy as np
+
+        dims = _normalize_index(self.shape, key)
+        sliced_shape = [count for _, count, _, _, _ in dims]
+        storage_dtype = np.dtype(NUMPY_STORAGE_DTYPE[self.dtype])
+
+        if math.prod(sliced_shape) == 0:
+            arr = np.empty(sliced_shape, dtype=storage_dtype)
+        else:
+            run_start, run_size, outer_axes = _plan_slice(
+                self.shape, storage_dtype.itemsize, dims
+            )
+
+            if not outer_axes:
+                buffer, offset = self._buffer(copy_on_write=False, copy=False)
+                arr = np.frombuffer(
+                    buffer,
+                    dtype=storage_dtype,
+                    count=run_size // storage_dtype.itemsize,
+                    offset=offset + run_start,
+                )
+            elif run_size >= mmap.PAGESIZE:
+                arr = np.empty(math.prod(sliced_shape), storage_dtype)
+                self.safetensor_file._readinto_many(
+                    _gathered_reads(
+                        self.data_offset_in_file, run_start, run_size, outer_axes, arr
+                    )
+                )
+            else:
+                full = self.numpy(raw=True)
+                arr = np.ascontiguousarray(
+                    full[
+                        tuple(
+                            slice(start, start + count * step, step)
+                            for start, count, step, _, _ in dims
+                        )
+                    ]
+                )
+            arr = arr.reshape(sliced_shape)
+
+        if _requires_decode(self.dtype) and not raw:
+            decoded = np.empty(sliced_shape, dtype="float32")
+            _decode_to_float32(self.dtype, arr.reshape(-1), decoded.reshape(-1))
+            arr = decoded
+
+        return arr[
+            tuple(
+                (0 if not keep_dim else slice(None, None, -1 if flip else 1))
+                for _, _, _, keep_dim, flip in dims
+            )
+        ]
+
+    def _cached_content_hash(self) -> Optional[str]:
+        file = self.safetensor_file
+        if file._header_cache is None:
+            return None
+        return file._header_cache.get_hash(file.filepath, file._stat, self.name)
+
+    def torch(self, copy_on_write: bool = False, copy: bool = False) -> "torch.Tensor":
+        """Returns a view of the tensor
+
+        The returned tensor is backed by a memory map of the
+        safetensors file, and no data is read until it is accessed.
+
+        Pytorch has no concept of a read-only tensor, so by default
+        the returned tensor must not be modified.  Writing to it,
+        including any in-place operation, will crash the process.  If
+        `copy_on_write` is True, the tensor may be modified.  Any
+        writes are private to the returned tensor, and are not written
+        back to the file.
+
+        If `copy` is True, the tensor is instead read into a newly
+        allocated buffer before returning.
+        """
+        import torch
+
+        dtype = self.torch_dtype
+
+        if self.num_elements == 0:
+            return torch.empty(self.shape, dtype=dtype)
+
+        buffer, offset = self._buffer(copy_on_write, copy)
+
+        with warnings.catch_warnings():
+            # Pytorch warns whenever a tensor is created from a
+            # read-only buffer.  This is expected for the default
+            # read-only mapping, and is documented above.
+            warnings.filterwarnings(
+                "ignore",
+                message="The given buffer is not writable",
+                category=UserWarning,
+            )
+            arr = torch.frombuffer(
+                buffer,
+                dtype=dtype,
+                count=self.num_elements,
+                offset=offset,
+            )
         arr = arr.reshape(self.shape)
 
         return arr
 
 
-def main(args):
-    safetensors = LazySafetensorCollection(*args.safetensor_files)
+class SafetensorWriter:
+    """Writes a safetensors file, one tensor at a time
+
+    The dtype and shape of every tensor must be declared up front.
+    From these, the header is written immediately, and the file is
+    sized to hold all tensors.  Each tensor's bytes may then be written
+    as soon as they are produced, in any order, and optionally in
+    several pieces.  Only the tensor currently being written needs to
+    be held in memory.
+
+    Example:
+
+        specs = {"weight": ("F32", [1024, 1024])}
+        with SafetensorWriter("out.safetensors", specs) as writer:
+            writer.write("weight", np.zeros([1024, 1024], "float32"))
+
+    If the writer is closed before every tensor has been written in
+    full, or if an exception is raised within the `with` block, the
+    partially-written file is removed.
+    """
 
+    def __init__(
+        self,
+        filepath: Union[str, pathlib.Path],
+        tensors: Dict[str, Tuple[str, Iterable[int]]],
+        metadata: Optional[Dict[str, str]] = None,
+    ):
+        import json
+
+        self.filepath = pathlib.Path(filepath)
+
+        header = {}
+        if metadata is not None:
+            header["__metadata__"] = metadata
+
+        # The dtype, offset, and size of each tensor
+        self._tensor_layout: Dict[str, Tuple[str, int, int]] = {}
+        offset = 0
+        for name, (dtype, shape) in tensors.items():
+            shape = [int(dim) for dim in shape]
+            nbytes = math.prod(shape) * BYTES_PER_ELEMENT[dtype]
+            header[name] = {
+                "dtype": dtype,
+                "shape": shape,
+                "data_offsets": [offset, offset + nbytes],
+            }
+            self._tensor_layout[name] = (dtype, offset, nbytes)
+            offset += nbytes
+
+        json_header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        # Pad the header with spaces, so that the tensor data is
+        # aligned to 8 bytes.
+        json_header += b" " * (-len(json_header) % 8)
+
+        self._header = struct.pack("<Q", len(json_header)) + json_header
+        self.data_offset_in_file = len(self._header)
+        self.num_bytes = self.data_offset_in_file + offset
+
+        # The sorted, non-overlapping [start, end) byte ranges written
+        # to each tensor, and their total size.
+        self._written_ranges = {name: [] for name in self._tensor_layout}
+        self._bytes_written = {name: 0 for name in self._tensor_layout}
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> "SafetensorWriter":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(discard=exc_type is not None)
+
+    def open(self):
+        self._fd = os.open(self.filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self._fd, self.num_bytes)
+        self._pwrite(memoryview(self._header), 0)
+
+    def close(self, discard: bool = False):
+        """Close the file
+
+        Raises an exception if any tensor has not been written in
+        full, unless `discard` is True.  In either case, an incomplete
+        file is removed.
+        """
+        if self._fd is None:
+            return
+
+        os.close(self._fd)
+        self._fd = None
+
+        incomplete = [
+            name
+            for name, (_, _, nbytes) in self._tensor_layout.items()
+            if self._bytes_written[name] != nbytes
+        ]
+        if discard or incomplete:
+            self.filepath.unlink()
+        if incomplete and not discard:
+            raise ValueError(
+                f"Closed {self.filepath} before tensors were fully written: "
+                f"{incomplete}"
+            )
+
+    def tensor_offset_in_file(self, name: str) -> int:
+        """The position in the file of the named tensor's first byte"""
+        _, tensor_offset, _ = self._tensor_layout[name]
+        return self.data_offset_in_file + tensor_offset
+
+    def write(self, name: str, data, offset: int = 0):
+        """Write bytes of the named tensor
+
+        `data` may be a numpy array, a pytorch tensor, a
+        `LazySafetensor`, or any object implementing the buffer
+        protocol.  Its bytes are written starting `offset` bytes from
+        the start of the tensor, allowing a large tensor to be written
+        in several pieces.  The pieces may not overlap.
+        """
+        if self._fd is None:
+            raise RuntimeError(f"{self.filepath} is not open for writing")
+
+        dtype, tensor_offset, nbytes = self._tensor_layout[name]
+
+        if isinstance(data, LazySafetensor):
+            if data.dtype != dtype:
+                raise TypeError(
+                    f"Tensor '{name}' was declared with dtype {dtype}, "
+                    f"but was written with dtype {data.dtype}"
+                )
+            buffer, buffer_offset = data._buffer(copy_on_write=False, copy=False)
+            data = memoryview(buffer)[buffer_offset : buffer_offset + data.num_bytes]
+        elif _is_torch_tensor(data) or hasattr(data, "__array_interface__"):
+            if safetensor_dtype(data) != dtype:
+                raise TypeError(
+                    f"Tensor '{name}' was declared with dtype {dtype}, "
+                    f"but was written with dtype {safetensor_dtype(data)}"
+                )
+
+        view = _as_byte_view(data)
+        if offset < 0 or offset + view.nbytes > nbytes:
+            raise ValueError(
+                f"Cannot write bytes [{offset}, {offset + view.nbytes}) "
+                f"to tensor '{name}' of {nbytes} bytes"
+            )
+
+        self._mark_written(name, offset, offset + view.nbytes)
+        self._pwrite(view, self.data_offset_in_file + tensor_offset + offset)
+
+    def copy_from(self, name: str, tensor: "LazySafetensor"):
+        """Copy a tensor's bytes from another safetensors file
+
+        Where supported, the copy is performed by the kernel, using
+        `os.copy_file_range` or `os.sendfile`, and the bytes never
+        pass through a Python buffer.  Otherwise, the bytes are copied
+        from a memory map of the source file.
+        """
+        if self._fd is None:
+            raise RuntimeError(f"{self.filepath} is not open for writing")
+
+        dtype, tensor_offset, nbytes = self._tensor_layout[name]
+        if tensor.dtype != dtype or tensor.num_bytes != nbytes:
+            raise TypeError(
+                f"Tensor '{name}' was declared with dtype {dtype} and {nbytes} bytes, "
+                f"but was copied from a tensor with dtype {tensor.dtype} "
+                f"and {tensor.num_bytes} bytes"
+            )
+        self._mark_written(name, 0, nbytes)
+
+        src_offset = tensor.data_offset_in_file
+        dst_offset = self.data_offset_in_file + tensor_offset
+        with _OPEN_FILES.pin(tensor.safetensor_file) as open_file:
+            nbytes_copied = self._kernel_copy(
+                open_file.fd, src_offset, dst_offset, nbytes
+            )
+
+        if nbytes_copied < nbytes:
+            buffer, buffer_offset = tensor._buffer(copy_on_write=False, copy=False)
+            view = memoryview(buffer)[
+                buffer_offset + nbytes_copied : buffer_offset + nbytes
+            ]
+            self._pwrite(view, dst_offset + nbytes_copied)
+
+    def _mark_written(self, name: str, start: int, end: int):
+        """Record that bytes [start, end) of a tensor are being written
+
+        Raises a ValueError if any of these bytes were already
+        written, since a repeated write would otherwise hide a range
+        that was never written at all.
+        """
+        if start == end:
+            return
+
+        import bisect
+
+        ranges = self._written_ranges[name]
+        index = bisect.bisect_left(ranges, (start, end))
+        prev_end = ranges[index - 1][1] if index > 0 else 0
+        next_start = ranges[index][0] if index < len(ranges) else math.inf
+        if start < prev_end or next_start < end:
+            raise ValueError(
+                f"Bytes [{start}, {end}) of tensor '{name}' overlap bytes "
+                f"that have already been written"
+            )
+
+        ranges.insert(index, (start, end))
+        self._bytes_written[name] += end - start
+
+    def _kernel_copy(
+        self, src_fd: int, src_offset: int, dst_offset: int, nbytes: int
+    ) -> int:
+        """Copy bytes between files without a userspace buffer
+
+        Returns the number of bytes copied, which may be less than
+        `nbytes` if neither `os.copy_file_range` nor `os.sendfile` is
+        supported for these files.
+        """
+        copied = 0
+
+        if hasattr(os, "copy_file_range"):
+            try:
+                while copied < nbytes:
+                    step = os.copy_file_range(
+                        src_fd,
+                        self._fd,
+                        nbytes - copied,
+                        src_offset + copied,
+                        dst_offset + copied,
+                    )
+                    if step == 0:
+                        break
+                    copied += step
+            except OSError:
+                # Not supported by this kernel or filesystem (e.g.
+                # ENOSYS, EXDEV, EINVAL).  Fall back to sendfile.
+                pass
+
+        if hasattr(os, "sendfile") and copied < nbytes:
+            # sendfile writes at the destination's file position,
+            # rather than taking an explicit offset.
+            try:
+                os.lseek(self._fd, dst_offset + copied, os.SEEK_SET)
+                while copied < nbytes:
+                    step = os.sendfile(
+                        self._fd, src_fd, src_offset + copied, nbytes - copied
+                    )
+                    if step == 0:
+                        break
+                    copied += step
+            except OSError:
+                pass
+
+        return copied
+
+    def _pwrite(self, view: memoryview, offset: int):
+        while view:
+            nbytes_written = os.pwrite(self._fd, view, offset)
+            view = view[nbytes_written:]
+            offset += nbytes_written
+
+
+def plan_shards(
+    tensor_sizes: Iterable[Tuple[str, int]], max_shard_bytes: int
+) -> List[List[str]]:
+    """Group tensors into shards of roughly equal size
+
+    Given the name and size in bytes of each tensor, returns the names
+    to be placed in each shard.  Tensors stay in the order given, and
+    the number of shards is the smallest for which no shard exceeds
+    `max_shard_bytes`, aside from single tensors that are larger than
+    `max_shard_bytes` on their own.  Rather than filling each shard
+    to the limit and leaving a small final shard, each boundary is
+    placed as close as possible to an even split of the total size.
+    """
+    tensor_sizes = list(tensor_sizes)
+    num_tensors = len(tensor_sizes)
+    if num_tensors == 0:
+        return [[]]
+
+    # prefix_bytes[i] is the total size of the first i tensors
+    prefix_bytes = [0, *itertools.accumulate(nbytes for _, nbytes in tensor_sizes)]
+
+    # A shard starting at tensor i may extend up to (but excluding)
+    # tensor shard_end[i].  A shard always holds at least one tensor.
+    shard_end = [0] * num_tensors
+    end = 0
+    for start in range(num_tensors):
+        end = max(end, start + 1)
+        while (
+            end < num_tensors
+            and prefix_bytes[end + 1] - prefix_bytes[start] <= max_shard_bytes
+        ):
+            end += 1
+        shard_end[start] = end
+
+    # Filling each shard to the limit gives the fewest shards.
+    # min_shards[i] is the fewest shards that can hold the tensors
+    # from i onwards.
+    min_shards = [0] * (num_tensors + 1)
+    for start in reversed(range(num_tensors)):
+        min_shards[start] = 1 + min_shards[shard_end[start]]
+    num_shards = min_shards[0]
+
+    # Choose each boundary in turn, nearest to an even split, among
+    # those that leave few enough shards for the remaining tensors.
+    boundaries = [0]
+    for i in range(1, num_shards):
+        start = boundaries[-1]
+        target_bytes = prefix_bytes[-1] * i / num_shards
+        candidates = [
+            end
+            for end in range(start + 1, shard_end[start] + 1)
+            if min_shards[end] <= num_shards - i
+        ]
+        boundaries.append(
+            min(candidates, key=lambda end: abs(prefix_bytes[end] - target_bytes))
+        )
+    boundaries.append(num_tensors)
+
+    return [
+        [name for name, _ in tensor_sizes[start:end]]
+        for start, end in zip(boundaries[:-1], boundaries[1:])
+    ]
+
+
+def shard_filenames(num_shards: int, prefix: str = "model") -> List[str]:
+    """The conventional filenames of a sharded checkpoint"""
+    if num_shards == 1:
+        return [f"{prefix}.safetensors"]
+    return [
+        f"{prefix}-{i + 1:05d}-of-{num_shards:05d}.safetensors"
+        for i in range(num_shards)
+    ]
+
+
+def write_index_file(
+    filepath: Union[str, pathlib.Path],
+    weight_map: Dict[str, str],
+    total_size: int,
+):
+    """Write a `model.safetensors.index.json` file"""
+    import json
+
+    index = {
+        "metadata": {"total_size": total_size},
+        "weight_map": weight_map,
+    }
+    with open(filepath, "w") as f:
+        json.dump(index, f, indent=2)
+        f.write("\n")
+
+
+def reshard(
+    collection: "LazySafetensorCollection",
+    output_dir: Union[str, pathlib.Path],
+    max_shard_bytes: int,
+    metadata: Optional[Dict[str, str]] = None,
+    max_workers: Optional[int] = None,
+) -> List[pathlib.Path]:
+    """Repack a collection of tensors into shards of a given size
+
+    The shards are written to `output_dir` using the conventional
+    filenames, along with a `model.safetensors.index.json` if more
+    than one shard is required.  Tensor bytes are copied by the
+    kernel where possible (see `SafetensorWriter.copy_from`), and the
+    shards are written in parallel.
+
+    Since the tensors are copied from the source files while the
+    shards are written, `output_dir` must not already hold any
+    `*.safetensors` files, and in particular must not be the directory
+    holding the collection.
+
+    Returns the paths of the shards written.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    output_dir = pathlib.Path(output_dir)
+    if metadata is None:
+        metadata = {"format": "pt"}
+
+    tensors = list(collection.values())
+    shards = plan_shards(
+        [(tensor.name, tensor.num_bytes) for tensor in tensors], max_shard_bytes
+    )
+    filepaths = [
+        output_dir.joinpath(filename) for filename in shard_filenames(len(shards))
+    ]
+
+    source_paths = {tensor.safetensor_file.filepath.resolve() for tensor in tensors}
+    overwritten = [
+        filepath for filepath in filepaths if filepath.resolve() in source_paths
+    ]
+    if overwritten:
+        raise ValueError(
+            f"Cannot reshard into {output_dir}, "
+            f"as it would overwrite the source file {overwritten[0]}"
+        )
+    if output_dir.is_dir() and any(output_dir.glob("*.safetensors")):
+        raise ValueError(
+            f"Cannot reshard into {output_dir}, "
+            f"as it already contains *.safetensors files"
+        )
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    def _write_shard(filepath: pathlib.Path, names: List[str]):
+        specs = {
+            name: (collection[name].dtype, collection[name].shape) for name in names
+        }
+        with SafetensorWriter(filepath, specs, metadata=metadata) as writer:
+            for name in names:
+                writer.copy_from(name, collection[name])
+
+    max_workers = max_workers or min(8, len(shards))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(_write_shard, filepaths, shards))
+
+    if len(shards) > 1:
+        write_index_file(
+            output_dir.joinpath("model.safetensors.index.json"),
+            weight_map={
+                name: filepath.name
+                for filepath, names in zip(filepaths, shards)
+                for name in names
+            },
+            total_size=sum(tensor.num_bytes for tensor in tensors),
+        )
+
+    return filepaths
+
+
+class TensorDiff(typing.NamedTuple):
+    """The difference between two versions of a tensor
+
+    `status` is one of:
+
+    - "identical": The tensors have the same dtype, shape, and bytes.
+    - "different": The tensors have the same shape, but differ in
+      dtype or in value.  The error statistics are populated.
+    - "shape_mismatch": The tensors have different shapes, and could
+      not be compared.
+    - "only_in_a"/"only_in_b": The tensor exists in only one of the
+      collections.
+
+    Relative errors are measured against the larger magnitude of the
+    two values, and so lie in the range [0, 2].  The error statistics
+    cover only the elements that are finite in both tensors.  Elements
+    that are NaN or infinite in either tensor, and that are not the
+    same non-finite value in both, are counted in
+    `num_nonfinite_mismatches`.
+    """
+
+    name: str
+    status: str
+    num_elements: int = 0
+    max_abs_error: float = 0.0
+    mean_abs_error: float = 0.0
+    max_rel_error: float = 0.0
+    cosine_similarity: float = 1.0
+    num_nonfinite_mismatches: int = 0
+
+
+def _raw_bytes_equal(a: LazySafetensor, b: LazySafetensor, chunk_elements: int) -> bool:
+    import numpy as np
+
+    if a.dtype != b.dtype or a.shape != b.shape:
+        return False
+
+    # If both hashes have already been computed with the same
+    # algorithm, they can be compared without reading either tensor.
+    hash_a = a._cached_content_hash()
+    hash_b = b._cached_content_hash() if hash_a is not None else None
+    if hash_a is not None and hash_b is not None:
+        algorithm_a, _ = hash_a.split(":", 1)
+        algorithm_b, _ = hash_b.split(":", 1)
+        if algorithm_a == algorithm_b:
+            return hash_a == hash_b
+
+    # Compare the bytes rather than the values, as NaN != NaN, and
+    # -0.0 == 0.0.
+    chunks_a = a.iter_chunks(chunk_elements, raw=True)
+    chunks_b = b.iter_chunks(chunk_elements, raw=True)
+    return all(
+        np.array_equal(chunk_a.view(np.uint8), chunk_b.view(np.uint8))
+        for (_, chunk_a), (_, chunk_b) in zip(chunks_a, chunks_b)
+    )
+
+
+def diff_tensors(
+    a: LazySafetensor,
+    b: LazySafetensor,
+    chunk_elements: int = 1 << 22,
+) -> TensorDiff:
+    """Compare two tensors, reading one chunk of each at a time
+
+    The raw bytes are compared first, one chunk at a time, stopping at
+    the first difference.  Only if they differ are the values
+    converted to float64 for comparison.  See `TensorDiff` for the
+    handling of NaN and infinite values.
+    """
+    import numpy as np
+
+    if list(a.shape) != list(b.shape):
+        return TensorDiff(a.name, "shape_mismatch", num_elements=a.num_elements)
+
+    if _raw_bytes_equal(a, b, chunk_elements):
+        return TensorDiff(a.name, "identical", num_elements=a.num_elements)
+
+    max_abs_error = 0.0
+    sum_abs_error = 0.0
+    max_rel_error = 0.0
+    dot_product = 0.0
+    norm_squared_a = 0.0
+    norm_squared_b = 0.0
+    num_finite = 0
+    num_nonfinite_mismatches = 0
+
+    chunks_a = a.iter_chunks(chunk_elements)
+    chunks_b = b.iter_chunks(chunk_elements)
+    for (_, chunk_a), (_, chunk_b) in zip(chunks_a, chunks_b):
+        chunk_a = chunk_a.astype(np.float64)
+        chunk_b = chunk_b.astype(np.float64)
+
+        is_finite = np.isfinite(chunk_a) & np.isfinite(chunk_b)
+        if not is_finite.all():
+            is_same = (chunk_a == chunk_b) | (np.isnan(chunk_a) & np.isnan(chunk_b))
+            num_nonfinite_mismatches += int(np.count_nonzero(~is_finite & ~is_same))
+            chunk_a = chunk_a[is_finite]
+            chunk_b = chunk_b[is_finite]
+
+        num_finite += chunk_a.size
+        if chunk_a.size == 0:
+            continue
+
+        abs_error = np.abs(chunk_a - chunk_b)
+        magnitude = np.maximum(np.abs(chunk_a), np.abs(chunk_b))
+        rel_error = np.divide(
+            abs_error, magnitude, out=np.zeros_like(abs_error), where=magnitude > 0
+        )
+
+        max_abs_error = max(max_abs_error, float(abs_error.max()))
+        sum_abs_error += float(abs_error.sum())
+        max_rel_error = max(max_rel_error, float(rel_error.max()))
+        dot_product += float(np.dot(chunk_a, chunk_b))
+        norm_squared_a += float(np.dot(chunk_a, chunk_a))
+        norm_squared_b += float(np.dot(chunk_b, chunk_b))
+
+    if norm_squared_a == 0 and norm_squared_b == 0:
+        cosine_similarity = 1.0
+    elif norm_squared_a == 0 or norm_squared_b == 0:
+        cosine_similarity = 0.0
+    else:
+        cosine_similarity = dot_product / math.sqrt(norm_squared_a * norm_squared_b)
+
+    return TensorDiff(
+        a.name,
+        "different",
+        num_elements=a.num_elements,
+        max_abs_error=max_abs_error,
+        mean_abs_error=sum_abs_error / max(num_finite, 1),
+        max_rel_error=max_rel_error,
+        cosine_similarity=cosine_similarity,
+        num_nonfinite_mismatches=num_nonfinite_mismatches,
+    )
+
+
+def diff_collections(
+    a: LazySafetensorCollection,
+    b: LazySafetensorCollection,
+    chunk_elements: int = 1 << 22,
+) -> List[TensorDiff]:
+    """Compare each tensor in two collections
+
+    Tensors are streamed from both collections, one chunk of each at a
+    time, so memory usage is bounded by `chunk_elements` regardless of
+    tensor size.
+
+    Returns a report sorted by severity: tensors that could not be
+    compared first, then differing tensors in order of decreasing
+    number of mismatched NaN/infinite values and then decreasing
+    maximum absolute error, then identical tensors.
+    """
+    diffs = [
+        (
+            diff_tensors(a[name], b[name], chunk_elements)
+            if name in b
+            else TensorDiff(name, "only_in_a", num_elements=a[name].num_elements)
+        )
+        for name in a.keys()
+    ]
+    diffs.extend(
+        TensorDiff(name, "only_in_b", num_elements=b[name].num_elements)
+        for name in b.keys()
+        if name not in a
+    )
+
+    status_order = {
+        "only_in_a": 0,
+        "only_in_b": 0,
+        "shape_mismatch": 0,
+        "different": 1,
+        "identical": 2,
+    }
+    diffs.sort(
+        key=lambda diff: (
+            status_order[diff.status],
+            -diff.num_nonfinite_mismatches,
+            -diff.max_abs_error,
+        )
+    )
+    return diffs
+
+
+def print_diff_report(diffs: List[TensorDiff]):
+    num_identical = sum(diff.status == "identical" for diff in diffs)
+    rows = [
+        (
+            diff.name,
+            diff.status,
+            *(
+                [
+                    f"{diff.max_abs_error:.3g}",
+                    f"{diff.mean_abs_error:.3g}",
+                    f"{diff.max_rel_error:.3g}",
+                    f"{diff.cosine_similarity:.6f}",
+                    str(diff.num_nonfinite_mismatches),
+                ]
+                if diff.status == "different"
+                else ["-"] * 5
+            ),
+        )
+        for diff in diffs
+        if diff.status != "identical"
+    ]
+
+    if rows:
+        header = (
+            "name",
+            "status",
+            "max_abs",
+            "mean_abs",
+            "max_rel",
+            "cosine",
+            "nonfinite",
+        )
+        widths = [max(len(row[i]) for row in [header, *rows]) for i in range(7)]
+        for row in [header, *rows]:
+            line = "  ".join(value.ljust(width) for value, width in zip(row, widths))
+            print(line.rstrip())
+
+    print(
+        f"{len(diffs) - num_identical} of {len(diffs)} tensors differ, "
+        f"{num_identical} identical"
+    )
+
+
+class TensorStats(typing.NamedTuple):
+    """Summary statistics of a tensor
+
+    The minimum, maximum, mean, and standard deviation are computed
+    over the finite values only, and are None if there are no finite
+    values.  NaN and infinite values are counted separately.
+    """
+
+    name: str
+    dtype: str
+    shape: List[int]
+    num_elements: int
+    min: Optional[float]
+    max: Optional[float]
+    mean: Optional[float]
+    std: Optional[float]
+    nan_count: int
+    inf_count: int
+
+
+def tensor_stats(tensor: LazySafetensor, chunk_elements: int = 1 << 22) -> TensorStats:
+    """Compute summary statistics of a tensor in a single pass
+
+    The tensor is read one chunk at a time, so memory usage is bounded
+    by `chunk_elements` regardless of the tensor's size.  The mean and
+    variance of each chunk are combined using the parallel algorithm
+    of Chan et al., which avoids the cancellation error of summing
+    squares.
+    """
+    import numpy as np
+
+    count = 0
+    mean = 0.0
+    sum_squared_deviation = 0.0
+    min_value = math.inf
+    max_value = -math.inf
+    nan_count = 0
+    inf_count = 0
+
+    for _, chunk in tensor.iter_chunks(chunk_elements):
+        values = chunk.astype(np.float64)
+
+        is_finite = np.isfinite(values)
+        num_finite = int(np.count_nonzero(is_finite))
+        if num_finite != values.size:
+            chunk_nan_count = int(np.count_nonzero(np.isnan(values)))
+            nan_count += chunk_nan_count
+            inf_count += values.size - num_finite - chunk_nan_count
+            values = values[is_finite]
+
+        if values.size == 0:
+            continue
+
+        min_value = min(min_value, float(values.min()))
+        max_value = max(max_value, float(values.max()))
+
+        chunk_mean = float(values.mean())
+        values -= chunk_mean
+        chunk_sum_squared_deviation = float(np.dot(values, values))
+
+        total = count + values.size
+        delta = chunk_mean - mean
+        mean += delta * values.size / total
+        sum_squared_deviation += (
+            chunk_sum_squared_deviation + delta * delta * count * values.size / total
+        )
+        count = total
+
+    has_values = count > 0
+    return TensorStats(
+        name=tensor.name,
+        dtype=tensor.dtype,
+        shape=list(tensor.shape),
+        num_elements=tensor.num_elements,
+        min=min_value if has_values else None,
+        max=max_value if has_values else None,
+        mean=mean if has_values else None,
+        std=math.sqrt(sum_squared_deviation / count) if has_values else None,
+        nan_count=nan_count,
+        inf_count=inf_count,
+    )
+
+
+def write_stats_report(stats: List[TensorStats], output_format: str, output=None):
+    """Write tensor statistics as either "json" or "csv" """
+    import json
+    import sys
+
+    output = output or sys.stdout
+    rows = [tensor_stats._asdict() for tensor_stats in stats]
+
+    if output_format == "json":
+        json.dump(rows, output, indent=2)
+        output.write("\n")
+    elif output_format == "csv":
+        import csv
+
+        fieldnames = list(TensorStats._fields)
+        writer = csv.DictWriter(output, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            row["shape"] = "x".join(str(dim) for dim in row["shape"])
+            writer.writerow(row)
+    else:
+        raise ValueError(f"Unknown output format '{output_format}'")
+
+
+class _StartupProfile:
+    """Records the time taken by each step of startup
+
+    Reported by the --profile-startup flag.
+    """
+
+    def __init__(self):
+        self.steps: List[Tuple[str, float]] = []
+        self._last_time = _IMPORT_START_TIME
+
+    def mark(self, step: str):
+        """Record the time since the previous step as `step`"""
+        now = time.perf_counter()
+        self.steps.append((step, now - self._last_time))
+        self._last_time = now
+
+    def report(self):
+        import sys
+
+        width = max(len(step) for step, _ in self.steps)
+        print("Startup time:", file=sys.stderr)
+        for step, seconds in self.steps:
+            print(f"    {step:<{width}}  {1000*seconds:8.1f} ms", file=sys.stderr)
+        total = sum(seconds for _, seconds in self.steps)
+        print(f"    {'total':<{width}}  {1000*total:8.1f} ms", file=sys.stderr)
+
+
+def main(args, startup_profile: Optional[_StartupProfile] = None):
+    startup_profile = startup_profile or _StartupProfile()
+
+    header_cache = None if args.no_cache else HeaderCache()
+    safetensors = LazySafetensorCollection(
+        *args.safetensor_files, header_cache=header_cache
+    )
+    startup_profile.mark("find files")
+
+    if args.diff:
+        other = LazySafetensorCollection(*args.diff, header_cache=header_cache)
+        print_diff_report(safetensors.diff(other))
+        return
+
+    if args.stats:
+        write_stats_report(safetensors.stats(), args.stats)
+        return
+
+    if args.reshard:
+        filepaths = safetensors.reshard(
+            args.reshard,
+            max_shard_bytes=int(args.max_shard_gigabytes * 1024**3),
+        )
+        if not args.quiet:
+            print(f"Wrote {len(filepaths)} shards to {args.reshard}")
+        return
+
+    # Headers are only read here if needed for the startup message.
+    # Otherwise, they are read on first access to the tensors.
     if not args.quiet:
+        import textwrap
+
+        num_tensors = len(safetensors)
+        num_files = safetensors.num_files()
+        startup_profile.mark("read headers")
+
         print(
             "Found {num_tensors} {tensor_noun} in {num_files} {file_noun}".format(
-                num_tensors=len(safetensors),
-                tensor_noun="tensor" if len(safetensors) == 1 else "tensors",
-                num_files=safetensors.num_files(),
-                file_noun="file" if safetensors.num_files() == 1 else "files",
+                num_tensors=num_tensors,
+                tensor_noun="tensor" if num_tensors == 1 else "tensors",
+                num_files=num_files,
+                file_noun="file" if num_files == 1 else "files",
             )
         )
 
@@ -388,12 +2823,23 @@ def main(args):
         )
 
     try:
-        __import__("IPython").embed(colors="neutral")
+        IPython = __import__("IPython")
     except ImportError:
+        IPython = None
+    startup_profile.mark("import IPython")
+    if args.profile_startup:
+        startup_profile.report()
+
+    if IPython is not None:
+        IPython.embed(colors="neutral")
+    else:
         __import__("code").interact(local=locals())
 
 
 def arg_main():
+    startup_profile = _StartupProfile()
+    startup_profile.mark("import lazy_safetensor")
+
     import argparse
     import contextlib
     import sys
@@ -428,6 +2874,61 @@ def arg_main():
         action="store_true",
         help="Silence the startup messages",
     )
+    # Each of these replaces the interactive session, so at most one
+    # may be given.
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--diff",
+        type=pathlib.Path,
+        nargs="+",
+        metavar="OTHER",
+        help=(
+            "Instead of starting an interactive session, "
+            "compare each tensor against the file or directory OTHER, "
+            "and print a report of the differences"
+        ),
+    )
+    mode.add_argument(
+        "--stats",
+        choices=["json", "csv"],
+        help=(
+            "Instead of starting an interactive session, "
+            "print the min/max/mean/std and NaN/Inf counts of each tensor "
+            "in the specified format"
+        ),
+    )
+    mode.add_argument(
+        "--reshard",
+        type=pathlib.Path,
+        metavar="OUTPUT_DIR",
+        help=(
+            "Instead of starting an interactive session, "
+            "repack the tensors into shards of at most --max-shard-gigabytes, "
+            "written to OUTPUT_DIR"
+        ),
+    )
+    parser.add_argument(
+        "--max-shard-gigabytes",
+        type=float,
+        default=5.0,
+        help="The maximum size of each shard written by --reshard",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=(
+            "Do not read or write the cache of parsed headers "
+            "(by default, stored in ~/.cache/lazy_safetensor)"
+        ),
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help=(
+            "Print the time taken by each step of startup, "
+            "before starting the interactive session"
+        ),
+    )
     parser.add_argument(
         "--pdb",
         action="store_true",
@@ -435,12 +2936,13 @@ def arg_main():
     )
 
     args = parser.parse_args()
+    startup_profile.mark("parse arguments")
 
     with contextlib.ExitStack() as stack:
         if args.pdb:
             stack.enter_context(debug_on_except())
 
-        main(args)
+        main(args, startup_profile)
 
 
 if __name__ == "__main__":